@@ -0,0 +1,278 @@
+'''
+ptkinetic benchmark suite
+Run reference mechanisms with the Kinetic engine and report the speed, memory and accuracy
+Usage: python benchmarks/benchmark.py [--quick] [--check] [--output results.json] [--compare old.json]
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ptkinetic import Kinetic
+
+# Largest accepted error of the adaptive cases checked by --check, they guard the accuracy
+# of the step size control against an analytic or tight-tolerance reference
+TOLERANCE = {'logistic_adaptive': 1e-7, 'oregonator_adaptive': 1e-4}
+
+# Robertson problem at t = 40 (Hairer and Wanner)
+ROBERTSON_40 = np.array([0.7158270687, 9.185534764e-6, 0.2841637457])
+
+def tutorial(**options):
+    '''A + B -> C with B stable, from the tutorial'''
+    obj = Kinetic()
+    obj.add_chemical('A', 0.1)
+    obj.add_chemical('B', 0.5, True)
+    obj.add_chemical('C', 0.0)
+    obj.add_reaction(['A','B'], ['C'], 0.5)
+    obj.init(**options)
+    return obj
+
+def tutorial_check(**options):
+    '''The checking example of the tutorial, A + B -> C with a small amount of A'''
+    obj = Kinetic()
+    obj.add_chemical('A', 1e-5)
+    obj.add_chemical('B', 0.2)
+    obj.add_chemical('C', 0.0)
+    obj.add_reaction(['A','B'], ['C'], 0.01)
+    obj.init(**options)
+    return obj
+
+def robertson(**options):
+    '''The stiff Robertson problem'''
+    obj = Kinetic()
+    obj.add_chemical('A', 1.0)
+    obj.add_chemical('B', 0.0)
+    obj.add_chemical('C', 0.0)
+    obj.add_reaction(['A'], ['B'], 0.04)
+    obj.add_reaction(['B','B'], ['C','B'], 3e7)
+    obj.add_reaction(['B','C'], ['A','C'], 1e4)
+    obj.init(**options)
+    return obj
+
+def oregonator(**options):
+    '''Field-Koros-Noyes model of the Belousov-Zhabotinsky oscillator, A and B are stable'''
+    obj = Kinetic()
+    obj.add_chemical('A', 0.06, True) # BrO3-
+    obj.add_chemical('B', 0.02, True) # Organic species
+    obj.add_chemical('X', 1e-9) # HBrO2
+    obj.add_chemical('Y', 1e-6) # Br-
+    obj.add_chemical('Z', 1e-5) # Ce(IV)
+    obj.add_chemical('P', 0.0) # HOBr
+    obj.add_reaction(['A','Y'], ['X','P'], 1.28)
+    obj.add_reaction(['X','Y'], ['P','P'], 2.4e6)
+    obj.add_reaction(['A','X'], ['X','X','Z','Z'], 33.6)
+    obj.add_reaction(['X','X'], ['A','P'], 2.4e3)
+    obj.add_reaction(['B','Z'], ['Y'], 1.0)
+    obj.init(**options)
+    return obj
+
+def logistic(**options):
+    '''Logistic growth A -> 2 A, 2 A -> A, the step size of the adaptive methods grows and is rejected several times'''
+    obj = Kinetic()
+    obj.add_chemical('A', 1e-3)
+    obj.add_reaction(['A'], ['A','A'], 1.0)
+    obj.add_reaction(['A','A'], ['A'], 1.0)
+    obj.init(**options)
+    return obj
+
+def random_network(n_react, seed = 0, **options):
+    '''Random mass-action network with n_react reactions and n_react / 2 chemicals'''
+    rng = np.random.default_rng(seed)
+    n_chem = max(2, n_react // 2)
+    obj = Kinetic()
+    for i in range(n_chem):
+        obj.add_chemical('S{}'.format(i), rng.uniform(0.5, 1.5))
+    for r in range(n_react):
+        inp = ['S{}'.format(i) for i in rng.choice(n_chem, rng.integers(1, 3))]
+        outp = ['S{}'.format(i) for i in rng.choice(n_chem, rng.integers(1, 3))]
+        obj.add_reaction(inp, outp, rng.uniform(0.01, 0.1))
+    obj.init(**options)
+    return obj
+
+def relative_error(value, reference):
+    '''Largest error relative to the scale of each chemical'''
+    scale = np.maximum(np.abs(reference).max(axis = 0), 1e-300)
+    return float((np.abs(value - reference) / scale).max())
+
+def measure(name, build, runs, reference = None, memory = True):
+    '''Build the model and run it, runs is a list of (cycle, delta)
+reference: function of the model returning the reference data, or None'''
+    obj = build()
+    evaluations = 0
+    substeps = 0
+    start = time.perf_counter()
+    for cycle, delta in runs:
+        obj.run(cycle, delta)
+        evaluations += obj.stats['rate_evaluations']
+        substeps += obj.stats['substeps']
+    wall = time.perf_counter() - start
+    simulated = float(obj.times[-1] - obj.times[0])
+    expected = None if reference is None else reference(obj)
+    result = {'name': name, 'wall_time': wall, 'rate_evaluations': evaluations, 'steps': substeps,
+              'steps_per_second': substeps / wall if wall > 0 else None,
+              'evaluations_per_second': evaluations / wall if wall > 0 else None,
+              'wall_per_simulated_second': wall / simulated if simulated > 0 else None,
+              'error': None if expected is None else relative_error(np.asarray(obj.data), expected),
+              'peak_memory': None}
+    if memory:
+        # Separate pass, tracemalloc slows down the Python code
+        obj = build()
+        tracemalloc.start()
+        for cycle, delta in runs:
+            obj.run(cycle, delta)
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def cases(quick, sizes):
+    '''List of (name, build, runs, reference)'''
+    def tutorial_exact(obj):
+        c = np.empty((len(obj.times), 3))
+        c[:,0] = 0.1 * np.exp(-0.25 * obj.times)
+        c[:,1] = 0.5
+        c[:,2] = 0.1 - c[:,0]
+        return c
+    def check_exact(obj):
+        # B is in large excess, the reaction is close to pseudo first order
+        c = np.empty((len(obj.times), 3))
+        a0, b0, k = 1e-5, 0.2, 0.01
+        c[:,0] = a0 * (b0 - a0) / (b0 * np.exp((b0 - a0) * k * obj.times) - a0)
+        c[:,1] = b0 - a0 + c[:,0]
+        c[:,2] = a0 - c[:,0]
+        return c
+    def logistic_exact(obj):
+        a0 = 1e-3
+        return (1.0 / (1.0 + (1.0 / a0 - 1.0) * np.exp(-obj.times))).reshape((-1,1))
+    def robertson_exact(obj):
+        return np.array([[1.0, 0.0, 0.0], ROBERTSON_40])
+    scale = 10 if quick else 1
+    result = [
+        ('tutorial_euler', lambda: tutorial(num_of_steps = 100), [(200, 0.01), (150, 0.02)], tutorial_exact),
+        ('tutorial_compiled', lambda: tutorial(num_of_steps = 100, compiled = True), [(200, 0.01), (150, 0.02)], tutorial_exact),
+        ('tutorial_adaptive', lambda: tutorial(method = 'adaptive', rtol = 1e-8), [(200, 0.01), (150, 0.02)], tutorial_exact),
+        ('logistic_adaptive', lambda: logistic(method = 'adaptive', rtol = 1e-8, atol = 1e-12), [(20, 1.0)], logistic_exact),
+        ('tutorial_check', lambda: tutorial_check(num_of_steps = 100, check = True, criterion = 1e-4),
+         [(1000 // scale, 0.1)], check_exact),
+        ('robertson_stiff', lambda: robertson(method = 'stiff', rtol = 1e-8, atol = 1e-14), [(1, 40.0)], robertson_exact),
+        ('robertson_long', lambda: robertson(method = 'stiff', rtol = 1e-6, atol = 1e-12), [(100, 1e3)], None),
+    ]
+    # Reference of the oscillator with a much tighter tolerance
+    oregonator_runs = [(100 // scale, 1.0)]
+    def oregonator_reference(obj):
+        ref = oregonator(method = 'stiff', rtol = 1e-10, atol = 1e-16)
+        for cycle, delta in oregonator_runs:
+            ref.run(cycle, delta)
+        return np.asarray(ref.data)
+    result.append(('oregonator_stiff', lambda: oregonator(method = 'stiff', rtol = 1e-6, atol = 1e-12),
+                   oregonator_runs, oregonator_reference))
+    result.append(('oregonator_adaptive', lambda: oregonator(method = 'adaptive', rtol = 1e-6, atol = 1e-12),
+                   oregonator_runs, oregonator_reference))
+    for n in sizes:
+        runs = [(max(1, 100 // scale), 0.01)]
+        def reference(obj, n = n, runs = runs):
+            # Adaptive integration with a tight tolerance, only for the smaller networks
+            if n > 1000:
+                return None
+            ref = random_network(n, method = 'adaptive', rtol = 1e-10, atol = 1e-14)
+            for cycle, delta in runs:
+                ref.run(cycle, delta)
+            return np.asarray(ref.data)
+        result.append(('random_{}'.format(n), lambda n = n: random_network(n, num_of_steps = 10), runs, reference))
+    return result
+
+def startup(repeat = 5):
+    '''Time to import ptkinetic in a new interpreter, without the start of the interpreter itself, best of repeat'''
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    def best(code):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd = root, check = True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+    return best('import ptkinetic') - best('pass')
+
+def consistency():
+    '''Names of the checks failing: the options of run that should not change the recorded rows'''
+    failed = []
+    for record_every in (1, 5):
+        plain = robertson(num_of_steps = 100)
+        plain.run(10, 0.1, record_every)
+        sens = robertson(num_of_steps = 100)
+        sens.run(10, 0.1, record_every, sensitivity = True)
+        if not (np.array_equal(plain.times, sens.times) and np.array_equal(plain.data, sens.data)):
+            failed.append('sensitivity_record_every_{}'.format(record_every))
+    return failed
+
+def metadata():
+    '''Version of the code and the environment'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor()}
+
+def compare(results, file_name):
+    '''Print the speed ratio with a previous result file, above 1 is faster now'''
+    with open(file_name) as f:
+        old = {x['name']: x for x in json.load(f)['results']}
+    print('{:<24}{:>12}{:>12}{:>10}'.format('case', 'old (s)', 'new (s)', 'speedup'))
+    for x in results:
+        if x['name'] in old:
+            before = old[x['name']]['wall_time']
+            print('{:<24}{:>12.4g}{:>12.4g}{:>10.2f}'.format(x['name'], before, x['wall_time'], before / x['wall_time']))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark of the ptkinetic engine')
+    parser.add_argument('--quick', action = 'store_true', help = 'shorter runs and networks up to 1000 reactions')
+    parser.add_argument('--sizes', type = int, nargs = '*', default = None, help = 'numbers of reactions of the random networks')
+    parser.add_argument('--case', default = None, help = 'run only the cases whose name contains this text')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the peak memory measurement')
+    parser.add_argument('--no-startup', action = 'store_true', help = 'skip the import time measurement')
+    parser.add_argument('--check', action = 'store_true', help = 'exit with an error if a case is less accurate than TOLERANCE or a consistency check fails')
+    parser.add_argument('--output', default = None, help = 'JSON file receiving the results')
+    parser.add_argument('--compare', default = None, help = 'previous JSON results to compare with')
+    args = parser.parse_args(argv)
+    sizes = args.sizes
+    if sizes == None:
+        sizes = [10, 100, 1000] if args.quick else [10, 100, 1000, 10000, 100000]
+    results = []
+    import_time = None if args.no_startup else startup()
+    if import_time != None:
+        print('import time of ptkinetic: {:.4g} s'.format(import_time))
+    print('{:<24}{:>12}{:>14}{:>14}{:>12}{:>12}'.format('case', 'wall (s)', 'steps/s', 'wall/sim s', 'memory', 'error'))
+    for name, build, runs, reference in cases(args.quick, sizes):
+        if args.case != None and args.case not in name:
+            continue
+        x = measure(name, build, runs, reference, not args.no_memory)
+        results.append(x)
+        print('{:<24}{:>12.4g}{:>14.4g}{:>14.4g}{:>12}{:>12}'.format(
+            name, x['wall_time'], x['steps_per_second'] or 0.0, x['wall_per_simulated_second'] or 0.0,
+            x['peak_memory'] if x['peak_memory'] != None else '-',
+            '{:.2e}'.format(x['error']) if x['error'] != None else '-'))
+    output = {'metadata': metadata(), 'import_time': import_time, 'results': results}
+    if args.output != None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent = 1)
+    if args.compare != None:
+        compare(results, args.compare)
+    if args.check:
+        failed = [x['name'] for x in results if x['name'] in TOLERANCE and not x['error'] <= TOLERANCE[x['name']]]
+        failed += consistency()
+        if len(failed) > 0:
+            sys.exit('Accuracy check failed: ' + ', '.join(failed))
+    return output
+
+if __name__ == '__main__':
+    main()
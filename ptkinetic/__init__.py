@@ -1 +1,5 @@
 from .ptkinetic import *
+from .sweep import sweep
+from .stochastic import Stochastic
+from .mechanism import load_mechanism, save_mechanism
+from .spatial import ReactionDiffusion
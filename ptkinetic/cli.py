@@ -0,0 +1,127 @@
+'''
+ptkinetic package
+Command line runner: load a mechanism file, initialize and run it, write the trajectory
+Usage: ptkinetic mechanism.txt [--spec run.json] [--cycle N] [--delta D] [--output result.ptk]
+The run spec is a JSON file {"init": {...}, "run": {...}} with the arguments of Kinetic.init and Kinetic.run,
+the options given on the command line replace the ones of the spec
+Only NumPy is imported, pandas is loaded when the output is a csv file and matplotlib is never loaded
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from .mechanism import load_mechanism
+from . import storage
+
+NUMBER = (int, float)
+# Arguments of Kinetic.init and Kinetic.run accepted in a spec and their type, the callback cannot be given
+ARGUMENTS = {'init': {'num_of_steps': int, 'check': bool, 'criterion': NUMBER, 'sparse': bool, 'compiled': bool,
+                      'method': str, 'rtol': NUMBER, 'atol': NUMBER, 'reduce': bool},
+             'run': {'cycle': int, 'delta': NUMBER, 'record_every': int, 'steady': NUMBER, 'window': int,
+                     'callback_every': int, 'profile': bool, 'checkpoint': str, 'checkpoint_every': NUMBER,
+                     'sensitivity': bool, 'normalize': bool}}
+NULLABLE = ['criterion', 'sparse', 'steady', 'checkpoint'] # Their default is None
+TYPE_NAMES = {int: 'an integer', bool: 'true or false', NUMBER: 'a number', str: 'a string'}
+
+def parse(argv = None):
+    parser = argparse.ArgumentParser(prog = 'ptkinetic', description = 'Run a chemical kinetic mechanism')
+    parser.add_argument('mechanism', help = 'mechanism file, one chemical or reaction per line')
+    parser.add_argument('--spec', default = None, help = 'JSON run spec {"init": {...}, "run": {...}}')
+    parser.add_argument('--cycle', type = int, default = None, help = 'number of cycles')
+    parser.add_argument('--delta', type = float, default = None, help = 'time of one cycle')
+    parser.add_argument('--record-every', type = int, default = None, help = 'keep every n cycles')
+    parser.add_argument('--steady', type = float, default = None, help = 'stop when the relative change is below this')
+    parser.add_argument('--method', choices = ['euler', 'adaptive', 'stiff'], default = None)
+    parser.add_argument('--num-of-steps', type = int, default = None, help = 'Euler steps per cycle')
+    parser.add_argument('--rtol', type = float, default = None)
+    parser.add_argument('--atol', type = float, default = None)
+    parser.add_argument('--compiled', action = 'store_true', default = None, help = 'compile the network')
+    parser.add_argument('--reduce', action = 'store_true', default = None, help = 'remove the conservation laws')
+    parser.add_argument('--output', '-o', default = None,
+                        help = 'trajectory file, .ptk is written during the run, other names are csv, '
+                               'default is the mechanism name with .ptk')
+    parser.add_argument('--quiet', '-q', action = 'store_true', help = 'do not print the final concentrations')
+    parser.add_argument('--timing', action = 'store_true', help = 'print the time of each stage to stderr')
+    return parser.parse_args(argv)
+
+def read_spec(args):
+    '''Return the arguments of init and run from the spec file and the command line'''
+    init = {}
+    run = {}
+    if args.spec != None:
+        with open(args.spec) as f:
+            spec = json.load(f)
+        if not isinstance(spec, dict):
+            raise ValueError('The spec must be a JSON object {"init": {...}, "run": {...}}')
+        for stage in spec:
+            if stage not in ARGUMENTS:
+                raise ValueError('Unknown spec section: {}, expect init or run'.format(stage))
+            if not isinstance(spec[stage], dict):
+                raise ValueError('The {} section of the spec must be a JSON object'.format(stage))
+        init.update(spec.get('init', {}))
+        run.update(spec.get('run', {}))
+    for key in ['method', 'num_of_steps', 'rtol', 'atol', 'compiled', 'reduce']:
+        if getattr(args, key) != None:
+            init[key] = getattr(args, key)
+    for key in ['cycle', 'delta', 'record_every', 'steady']:
+        if getattr(args, key) != None:
+            run[key] = getattr(args, key)
+    for stage, values in (('init', init), ('run', run)):
+        allowed = ARGUMENTS[stage]
+        for key, value in values.items():
+            if key not in allowed:
+                raise ValueError('Unknown {} argument: {}, expect one of {}'.format(stage, key, ', '.join(allowed)))
+            if value is None and key in NULLABLE:
+                continue
+            # bool is a subclass of int, true is not accepted as a number
+            if not isinstance(value, allowed[key]) or (isinstance(value, bool) and allowed[key] is not bool):
+                raise ValueError('The {} argument {} must be {}'.format(stage, key, TYPE_NAMES[allowed[key]]))
+    for key in ['cycle', 'delta']:
+        if key not in run:
+            raise ValueError('The {} of the run is not given'.format(key))
+    return init, run
+
+def main(argv = None):
+    '''Entry point of the ptkinetic command, return the exit status'''
+    start = time.perf_counter()
+    args = parse(argv)
+    timing = []
+    try:
+        init, run = read_spec(args)
+        output = args.output
+        if output == None:
+            output = os.path.splitext(args.mechanism)[0] + storage.EXTENSION
+        obj = load_mechanism(args.mechanism)
+        timing.append(('load', time.perf_counter()))
+        obj.init(**init)
+        timing.append(('init', time.perf_counter()))
+        binary = storage.is_binary(output)
+        if binary:
+            obj.stream(output) # The rows go to the file during the run
+        obj.run(**run)
+        timing.append(('run', time.perf_counter()))
+        if binary:
+            obj.close_stream()
+        else:
+            obj.save(output)
+        timing.append(('write', time.perf_counter()))
+    except (OSError, ValueError, TypeError, RuntimeError) as error: # TypeError: a value of the wrong type in the spec
+        print('ptkinetic: error: {}'.format(error), file = sys.stderr)
+        return 1
+    if not args.quiet:
+        for name, c in zip(obj.chemicals, obj.data[-1]):
+            print('{}\t{!r}'.format(name, float(c)))
+    if args.timing:
+        last = start
+        for stage, t in timing:
+            print('{:<8}{:10.4f} s'.format(stage, t - last), file = sys.stderr)
+            last = t
+        print('{:<8}{:10.4f} s'.format('total', last - start), file = sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+'''
+ptkinetic package
+Generate the specialized right-hand side for a reaction network
+The stoichiometry is folded into the Python source, so one call advances the
+concentrations by num_of_steps Euler steps without any temporary array
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import numpy as np
+
+_cache = {} # Compiled functions, the key is the network topology
+SUM_CHUNK = 100 # Terms added in one expression, a longer sum is too deeply nested for the Python compiler
+
+def _numba():
+    '''The numba module or None when it is not installed, imported on the first compilation only'''
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba
+
+def _term(factor, name):
+    '''Source of factor * name, omit the factor 1'''
+    if factor == 1:
+        return name
+    return '{!r} * {}'.format(float(factor), name)
+
+def _sum(name, terms, indent):
+    '''Lines assigning the sum of terms to name, by chunks of SUM_CHUNK terms'''
+    lines = []
+    for start in range(0, len(terms), SUM_CHUNK):
+        operator = '=' if start == 0 else '+='
+        lines.append('{}{} {} {}'.format(indent, name, operator, ' + '.join(terms[start:start + SUM_CHUNK])))
+    return lines
+
+def generate(inp_ptr, inp_index, inp_order, outp_ptr, outp_index, outp_order, stables, check, to_list = True):
+    '''Return the source of the function advance(y, k, num_of_steps, criterion)
+to_list: convert the arrays to Python floats first, which are faster than NumPy scalars outside of Numba'''
+    n_chem = len(stables)
+    n_react = len(inp_ptr) - 1
+    consumed = [[] for i in range(n_chem)] # Terms of change_inp for each chemical
+    formed = [[] for i in range(n_chem)]
+    lines = ['def advance(y, k, num_of_steps, criterion):']
+    if to_list:
+        lines.append('    y = y.tolist()')
+        lines.append('    k = k.tolist()')
+    for i in range(n_chem):
+        lines.append('    y{} = y[{}]'.format(i, i))
+    for j in range(n_react):
+        lines.append('    k{} = k[{}]'.format(j, j))
+    lines.append('    for step in range(num_of_steps):')
+    for j in range(n_react):
+        factors = []
+        for e in range(inp_ptr[j], inp_ptr[j+1]):
+            i = inp_index[e]
+            if inp_order[e] == 1:
+                factors.append('y{}'.format(i))
+            else:
+                factors.append('y{} ** {!r}'.format(i, float(inp_order[e])))
+            consumed[i].append(_term(inp_order[e], 'r{}'.format(j)))
+        for e in range(outp_ptr[j], outp_ptr[j+1]):
+            formed[outp_index[e]].append(_term(outp_order[e], 'r{}'.format(j)))
+        lines.append('        r{} = {}'.format(j, ' * '.join(factors + ['k{}'.format(j)])))
+    for i in range(n_chem):
+        if consumed[i]:
+            lines.extend(_sum('i{}'.format(i), consumed[i], '        '))
+        if formed[i]:
+            lines.extend(_sum('o{}'.format(i), formed[i], '        '))
+    if check:
+        # Only check for consumed amount, not forming amount
+        for i in range(n_chem):
+            if consumed[i]:
+                lines.append('        if y{0} != 0.0 and abs(i{0} / y{0}) > criterion:'.format(i))
+                lines.append("            raise ValueError('The change in one step is too large, decrease the step size')")
+    for i in range(n_chem):
+        if stables[i]:
+            continue # Do not change if the concentration is stable
+        if consumed[i] and formed[i]:
+            lines.append('        y{0} = y{0} + (o{0} - i{0})'.format(i))
+        elif consumed[i]:
+            lines.append('        y{0} = y{0} - i{0}'.format(i))
+        elif formed[i]:
+            lines.append('        y{0} = y{0} + o{0}'.format(i))
+    lines.append('    out = np.empty({})'.format(n_chem))
+    for i in range(n_chem):
+        lines.append('    out[{0}] = y{0}'.format(i))
+    lines.append('    return out')
+    return '\n'.join(lines) + '\n'
+
+def compile_network(inp_ptr, inp_index, inp_order, outp_ptr, outp_index, outp_order, stables, check, use_numba = None):
+    '''Return the compiled advance function of the network, cached by its topology
+use_numba: None to use Numba when it is installed, True to require it, False to keep the Python function'''
+    numba = _numba() if use_numba != False else None
+    if use_numba == None:
+        use_numba = numba is not None
+    if use_numba and numba is None:
+        raise ImportError('Numba is not installed')
+    key = (tuple(inp_ptr), tuple(inp_index), tuple(inp_order), tuple(outp_ptr), tuple(outp_index),
+           tuple(outp_order), tuple(bool(x) for x in stables), bool(check), bool(use_numba))
+    if key in _cache:
+        return _cache[key]
+    source = generate(inp_ptr, inp_index, inp_order, outp_ptr, outp_index, outp_order, stables, check, not use_numba)
+    namespace = {'np': np}
+    exec(compile(source, '<ptkinetic network>', 'exec'), namespace)
+    function = namespace['advance']
+    if use_numba:
+        function = numba.njit(function)
+    _cache[key] = function
+    return function
@@ -0,0 +1,109 @@
+'''
+ptkinetic package
+Adaptive integrators used by Kinetic.run
+The system is autonomous, fun(y) returns the time derivative of the concentrations
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import numpy as np
+
+# Dormand-Prince 5(4) coefficients
+DP_C = np.array([0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0])
+DP_A = [[],
+        [1/5],
+        [3/40, 9/40],
+        [44/45, -56/15, 32/9],
+        [19372/6561, -25360/2187, 64448/6561, -212/729],
+        [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+        [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84]]
+DP_B = np.array([35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84, 0.0]) # 5th order, same as the last row of DP_A
+DP_E = DP_B - np.array([5179/57600, 0.0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40]) # Difference with 4th order
+
+SAFETY = 0.9 # Safety factor of the new step size
+MIN_FACTOR = 0.2 # Limit of the change of step size in one step
+MAX_FACTOR = 10.0
+
+def error_norm(error, y, y_new, rtol, atol):
+    '''Root mean square of the error scaled by the tolerance'''
+    scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+    return np.sqrt(np.mean((error / scale) ** 2))
+
+def dopri5(fun, y, f, duration, h, rtol, atol):
+    '''Advance y by duration with the Dormand-Prince 5(4) pair, the step size is chosen by the error estimate
+f is fun(y) at the start, it is reused as the first stage (first same as last)
+h is the first step size to try, None to start with the whole duration
+Return the new y, fun(new y), the step size for the next call and the number of accepted and rejected steps'''
+    t = 0.0
+    if h == None or h <= 0.0:
+        h = duration
+    accepted = 0
+    rejected = 0
+    k = np.zeros((7, len(y)))
+    while t < duration:
+        h_next = h # The step size to continue with, not cut by the end of the duration
+        last = t + h >= duration
+        if last:
+            h = duration - t
+        if h <= 1e-14 * max(duration, abs(t)):
+            raise ValueError('The step size is too small, the tolerance cannot be reached')
+        k[0] = f
+        for i in range(1, 7):
+            k[i] = fun(y + h * np.dot(DP_A[i], k[:i]))
+        y_new = y + h * np.dot(DP_B, k)
+        err = error_norm(h * np.dot(DP_E, k), y, y_new, rtol, atol)
+        if err <= 1.0:
+            t = duration if last else t + h
+            y = y_new
+            f = k[6].copy() # k is overwritten by the next trial step
+            accepted += 1
+            factor = MAX_FACTOR if err == 0.0 else min(MAX_FACTOR, SAFETY * err ** -0.2)
+            h = max(h * factor, h_next) if last else h * factor
+        else:
+            rejected += 1
+            h = h * max(MIN_FACTOR, SAFETY * err ** -0.2)
+    return y, f, h, accepted, rejected
+
+# Coefficients of the Rosenbrock 2(3) pair of Shampine and Reichelt (L-stable)
+ROS_D = 1.0 / (2.0 + np.sqrt(2.0))
+ROS_E32 = 6.0 + np.sqrt(2.0)
+
+def rosenbrock23(fun, jac, y, f, duration, h, rtol, atol):
+    '''Advance y by duration with the linearly implicit Rosenbrock 2(3) pair, for stiff systems
+jac(y) returns the Jacobian matrix of fun, it is computed once per step and kept when the step is rejected,
+the matrix I - h*d*J is inverted once per step size and used for the three stages
+The arguments and returned values are the same as dopri5'''
+    t = 0.0
+    if h == None or h <= 0.0:
+        h = duration
+    accepted = 0
+    rejected = 0
+    eye = np.eye(len(y))
+    J = jac(y)
+    while t < duration:
+        h_next = h
+        last = t + h >= duration
+        if last:
+            h = duration - t
+        if h <= 1e-14 * max(duration, abs(t)):
+            raise ValueError('The step size is too small, the tolerance cannot be reached')
+        W = np.linalg.inv(eye - (h * ROS_D) * J)
+        k1 = W.dot(f)
+        f1 = fun(y + 0.5 * h * k1)
+        k2 = W.dot(f1 - k1) + k1
+        y_new = y + h * k2
+        f2 = fun(y_new)
+        k3 = W.dot(f2 - ROS_E32 * (k2 - f1) - 2.0 * (k1 - f))
+        err = error_norm(h / 6.0 * (k1 - 2.0 * k2 + k3), y, y_new, rtol, atol)
+        if err <= 1.0:
+            t = duration if last else t + h
+            y = y_new
+            f = f2
+            accepted += 1
+            factor = MAX_FACTOR if err == 0.0 else min(MAX_FACTOR, SAFETY * err ** (-1/3))
+            h = max(h * factor, h_next) if last else h * factor
+            if t < duration:
+                J = jac(y)
+        else:
+            rejected += 1
+            h = h * max(MIN_FACTOR, SAFETY * err ** (-1/3))
+    return y, f, h, accepted, rejected
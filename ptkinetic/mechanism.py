@@ -0,0 +1,78 @@
+'''
+ptkinetic package
+Read and write a network as a mechanism text file
+Each line is a chemical or a reaction, the text after # is a comment:
+    A 0.1            chemical A with concentration 0.1
+    B 0.5 stable     chemical B kept at a constant concentration
+    A + B -> C 0.5   reaction with rate constant 0.5
+    2 A -> B 0.1     a coefficient before the name repeats the chemical
+    -> A 0.01        no reactant (or no product) is allowed
+The chemicals have to be declared before the reactions using them
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+from .ptkinetic import Kinetic
+
+ARROW = '->'
+STABLE = 'stable'
+
+def _side(text, line_number):
+    '''List of chemical names of one side of a reaction, with the coefficients expanded'''
+    names = []
+    for term in text.split(' + '):
+        words = term.split()
+        if len(words) == 0:
+            if text.strip() == '':
+                break # Empty side
+            raise ValueError('Line {}: empty term in the reaction'.format(line_number))
+        if len(words) == 1:
+            names.append(words[0])
+        elif len(words) == 2 and words[0].isdigit():
+            names.extend([words[1]] * int(words[0]))
+        else:
+            raise ValueError('Line {}: cannot read the term "{}"'.format(line_number, term.strip()))
+    return names
+
+def load_mechanism(file_name):
+    '''Build a Kinetic object from a mechanism file, it is not initialized yet
+The chemical names are looked up in a dictionary, so large networks load in linear time'''
+    obj = Kinetic()
+    with open(file_name) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if line == '':
+                continue
+            try:
+                if ARROW in line:
+                    left, right = line.split(ARROW, 1)
+                    right = right.rsplit(None, 1)
+                    if len(right) == 0:
+                        raise ValueError('Line {}: missing rate constant'.format(line_number))
+                    constant = float(right[-1])
+                    inp = _side(' ' + left + ' ', line_number)
+                    outp = _side(' ' + right[0] + ' ', line_number) if len(right) == 2 else []
+                    obj.add_reaction(inp, outp, constant)
+                else:
+                    words = line.split()
+                    if len(words) not in (2, 3) or (len(words) == 3 and words[2].lower() != STABLE):
+                        raise ValueError('Line {}: expect "name concentration [stable]"'.format(line_number))
+                    obj.add_chemical(words[0], float(words[1]), len(words) == 3)
+            except ValueError as error:
+                if str(error).startswith('Line '):
+                    raise
+                raise ValueError('Line {}: {}'.format(line_number, error)) from None
+    return obj
+
+def save_mechanism(kinetic, file_name):
+    '''Write the chemicals, initial concentrations and reactions of a Kinetic object to a mechanism file'''
+    if kinetic.flag_init:
+        stables = kinetic.stables
+        concentrations = kinetic.data[0]
+    else:
+        stables = kinetic.chemical_stables
+        concentrations = kinetic.concentrations
+    with open(file_name, 'w') as f:
+        for name, c, stable in zip(kinetic.chemicals, concentrations, stables):
+            f.write('{} {!r}{}\n'.format(name, float(c), ' ' + STABLE if stable else ''))
+        for inp, outp, constant in zip(kinetic.reaction_inputs, kinetic.reaction_outputs, kinetic.reaction_constants):
+            f.write('{} {} {} {!r}\n'.format(' + '.join(inp), ARROW, ' + '.join(outp), float(constant)))
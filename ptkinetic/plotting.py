@@ -0,0 +1,86 @@
+'''
+ptkinetic package
+Plot the concentrations of a Kinetic object
+Long trajectories are reduced by min/max decimation to about two points per pixel,
+and decimated again from the full data when the view is zoomed or panned
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import bisect
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import cm
+
+def downsample(x, y, n_points):
+    '''Keep the smallest and the largest y of each of n_points / 2 consecutive bins, with the first and last points
+The shape of the curve (peaks and oscillations) is kept, return the decimated x and y'''
+    n = len(x)
+    if n <= n_points:
+        return np.asarray(x), np.asarray(y)
+    n_bin = max(1, n_points // 2)
+    size = -(-n // n_bin)
+    n_bin = -(-n // size)
+    values = np.asarray(y, dtype = float)
+    if n_bin * size > n:
+        values = np.concatenate((values, np.full(n_bin * size - n, np.nan))) # The last bin is not full
+    blocks = values.reshape((n_bin, size))
+    base = np.arange(n_bin) * size
+    # NaN (a diverged run or the padding) is never chosen, a bin with only NaN keeps its first point
+    missing = np.isnan(blocks)
+    low = base + np.argmin(np.where(missing, np.inf, blocks), axis = 1)
+    high = base + np.argmax(np.where(missing, -np.inf, blocks), axis = 1)
+    index = np.unique(np.concatenate(([0, n - 1], low, high))) # Sorted, a bin with min == max gives one point
+    return np.asarray(x[index]), np.asarray(y[index])
+
+class Decimator:
+    '''Decimate the lines of an axes again from the full data when its x range changes'''
+    def __init__(self, ax, times, columns, lines, n_points):
+        self.ax = ax
+        self.times = times
+        self.columns = columns
+        self.lines = lines
+        self.n_points = n_points
+        ax.callbacks.connect('xlim_changed', self.update)
+
+    def update(self, ax = None):
+        low, high = self.ax.get_xlim()
+        # One point more on each side so that the line reaches the border
+        start = max(bisect.bisect_left(self.times, low) - 1, 0)
+        end = min(bisect.bisect_right(self.times, high) + 1, len(self.times))
+        for line, y in zip(self.lines, self.columns):
+            line.set_data(*downsample(self.times[start:end], y[start:end], self.n_points))
+
+def plot(kinetic, chemical = None, max_points = None, fig = None):
+    '''Plot the concentration of the chemicals, all of them if chemical is None
+max_points: number of points of each line, None for twice the width of the axes in pixels
+fig: an existing figure of plot to update in place, None to create a new one
+Return the figure'''
+    n_chem = kinetic.data.shape[1]
+    if chemical == None:
+        ind = range(n_chem) # Plot all the concentration
+    else:
+        ind = [kinetic.index[x] for x in chemical] # Plot the concentration given by chemical argument
+    if fig is None:
+        fig = plt.figure()
+        ax = fig.add_subplot(1,1,1)
+    else:
+        ax = fig.axes[0]
+        for line in list(ax.lines):
+            line.remove()
+    if max_points == None:
+        max_points = max(100, 2 * int(ax.get_window_extent().width))
+    times = kinetic.times
+    columns = [kinetic.data[:,j] for j in ind]
+    color_map = cm.rainbow(np.linspace(0,1,len(ind))) # Continuous rainbow color
+    lines = []
+    for i,j in enumerate(ind):
+        temp, = ax.plot(*downsample(times, columns[i], max_points), c=color_map[i], label = kinetic.chemicals[j])
+        lines.append(temp)
+    ax.relim()
+    ax.autoscale_view()
+    ax.legend()
+    # Keep a reference, the callbacks of matplotlib only hold weak references to methods
+    fig.decimator = Decimator(ax, times, columns, lines, max_points)
+    fig.canvas.draw_idle()
+    return fig
@@ -6,10 +6,64 @@ Last modified: December 2017
 Source: https://github.com/zeldery/ptkinetic
 '''
 
+import os
+import json
+import time
+import bisect
+
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import cm
+
+from .compiler import compile_network
+from .integrators import dopri5, rosenbrock23
+from . import storage
+
+# pandas and matplotlib are imported by the methods using them, a compute-only job never loads them
+
+# The network is evaluated with the compressed stoichiometry when it has more than SPARSE_SIZE
+# entries and less than SPARSE_DENSITY of them are nonzero
+SPARSE_SIZE = 10000
+SPARSE_DENSITY = 0.1
+
+def _compress(reactions, index):
+    '''Convert the list of chemical names of each reaction to the CSR arrays (ptr, index, order)'''
+    ptr = [0]
+    chem = []
+    order = []
+    for names in reactions:
+        count = {}
+        for name in names:
+            i = index[name]
+            count[i] = count.get(i, 0) + 1
+        for i in sorted(count):
+            chem.append(i)
+            order.append(count[i])
+        ptr.append(len(chem))
+    return np.array(ptr, dtype = int), np.array(chem, dtype = int), np.array(order, dtype = float)
+
+def _null_space(matrix, rtol = 1e-10):
+    '''Orthonormal basis of the null space of matrix, as rows'''
+    if matrix.shape[1] == 0:
+        return np.zeros((0, 0))
+    u, sv, vt = np.linalg.svd(matrix)
+    rank = int((sv > rtol * max(sv.max(), 1.0)).sum()) if len(sv) > 0 else 0
+    return vt[rank:]
+
+def _pivot_rows(basis, rtol = 1e-10):
+    '''Gauss-Jordan elimination of the rows of basis, return the reduced rows and the pivot column of each row
+The reduced rows are the identity on the pivot columns'''
+    basis = np.array(basis, dtype = float)
+    pivots = []
+    for r in range(len(basis)):
+        candidate = np.abs(basis[r])
+        candidate[pivots] = 0.0
+        c = int(candidate.argmax())
+        basis[r] /= basis[r,c]
+        for q in range(len(basis)):
+            if q != r:
+                basis[q] -= basis[q,c] * basis[r]
+        pivots.append(c)
+    basis[np.abs(basis) < rtol] = 0.0
+    return basis, pivots
 
 class Kinetic:
     '''The main class for Kinetic
@@ -20,12 +74,33 @@ class Kinetic:
         self.check = False # Whether check the criterion or not
         self.criterion = 1.0 # the criterion of the ratio between the change and current concentration of any chemicals
         self.num_of_steps = 1
+        self.sparse = False # Evaluate the rates with the compressed stoichiometry
+        self.compiled = False
+        self.kernel = None # The compiled function advancing the concentrations, None if not compiled
+        # Model reduction by the conservation laws: concentration[dependent] = totals - link . concentration[independent]
+        self.reduce = False
+        self.dependent = None
+        self.independent = None
+        self.link = None
+        self.totals = None
+        self.method = 'euler' # The integrator, 'euler' with num_of_steps fixed steps per cycle or 'adaptive'
+        self.rtol = 1e-6 # Relative and absolute tolerance of the adaptive integrator
+        self.atol = 1e-12
+        self.step_size = None # The last step size of the adaptive integrator
+        self.steady_time = None # The time the steady state was reached in the last run
+        self.stats = {} # Counters and timings of the last run
+        self.cancelled = False # Set by cancel to stop the run
+        self.interrupted = None # Arguments of the rest of the run saved in a checkpoint, see resume_run
+        self.sens_state = None # d(concentration)/d(rate constant) at the last row, integrated with sensitivity
+        self.sensitivity = None # The sensitivity of the recorded rows of the last run
+        self.jac_pattern = None # Index arrays to build the Jacobian, computed at the first use
 
         # Flag variables
         self.flag_init = False
         self.flag_run = False
         # Chemical properties
         self.chemicals = [] # Contain the name of reaction
+        self.index = {} # Position of each chemical name in chemicals
         self.concentrations = [] # Contain the initial concentration
         self.chemical_stables = [] # True if the concentration does not change during the simulation
         # Reaction properties
@@ -34,19 +109,119 @@ class Kinetic:
         self.reaction_constants = [] # List of rate constants
 
         # Data variables
-        self.times = None
-        self.data = None
+        # times and data are views of the first size rows of the buffers, which grow by doubling
+        self._times = None
+        self._data = None
+        self.size = 0
+        # Streaming to a binary file, the rows are written by blocks and only the unwritten ones stay in memory
+        self.sink = None # The TrajectoryWriter, None if not streaming
+        self.block_size = 1024
+        self.written = 0 # Number of rows at the beginning of data already in the file
         self.k = None
+        self.inp_marker = None
+        self.outp_marker = None
         # Other properties
         self.fig = [] # List of figure object, for clean-up only
 
 
+    def __getstate__(self):
+        '''The compiled kernel and the figures are not pickled'''
+        state = self.__dict__.copy()
+        state['kernel'] = None
+        state['fig'] = []
+        state['sink'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.compiled and self.flag_init:
+            self.kernel = compile_network(self.inp_ptr, self.inp_index, self.inp_order, self.outp_ptr,
+                                          self.outp_index, self.outp_order, self.chemical_stables, self.check)
+
+    @property
+    def times(self):
+        '''The time of each recorded row'''
+        if self._times is None:
+            return None
+        return self._times[:self.size]
+
+    @times.setter
+    def times(self, value):
+        self._times = None if value is None else np.asarray(value)
+        self.size = 0 if value is None else len(self._times)
+
+    @property
+    def data(self):
+        '''The recorded concentrations, each row is a time, each column is a chemical'''
+        if self._data is None:
+            return None
+        return self._data[:self.size]
+
+    @data.setter
+    def data(self, value):
+        self._data = None if value is None else np.asarray(value)
+        self.size = 0 if value is None else len(self._data)
+
+    def reserve(self, n):
+        '''Make room for n more rows, the capacity is at least doubled to keep the cost of appending amortized'''
+        capacity = len(self._times)
+        if self.size + n <= capacity:
+            return
+        capacity = max(self.size + n, 2 * capacity)
+        times = np.empty(capacity)
+        times[:self.size] = self._times[:self.size]
+        data = np.empty((capacity, self._data.shape[1]))
+        data[:self.size] = self._data[:self.size]
+        self._times = times
+        self._data = data
+
+    def record(self, time, temp):
+        '''Append a row, the room must be reserved'''
+        self._times[self.size] = time
+        self._data[self.size] = temp
+        self.size += 1
+        if self.sink is not None and self.size - self.written >= self.block_size:
+            self.flush_stream()
+
+    def stream(self, file_name, block_size = 1024):
+        '''Write the trajectory to a binary file during run, by blocks of block_size rows
+The rows already recorded are written first, after that data only keeps the rows not yet written
+and the last one, so the memory does not grow with the length of the run'''
+        if not self.flag_init:
+            raise RuntimeError('You have to initialize before streaming')
+        if self.sink is not None:
+            self.close_stream()
+        self.sink = storage.TrajectoryWriter(file_name, self.chemicals)
+        self.block_size = block_size
+        self.written = 0
+        self.flush_stream()
+
+    def flush_stream(self):
+        '''Write the rows not yet in the file and free them, keep only the last row'''
+        self.sink.write(self.times[self.written:], self.data[self.written:])
+        self.sink.flush()
+        data = self.data[[-1],:].copy()
+        times = self.times[[-1]].copy()
+        self.data = data
+        self.times = times
+        self.written = 1
+        self.reserve(self.block_size)
+
+    def close_stream(self):
+        '''Write the remaining rows and close the file'''
+        if self.sink is None:
+            return
+        self.flush_stream()
+        self.sink.close()
+        self.sink = None
+
     def add_chemical(self,name,concentration,stable = False):
         '''Add chemical nomenclature to the model'''
         if self.flag_init:
             raise RuntimeError('Cannot add chemical after initialized')
-        if name in self.chemicals:
+        if name in self.index:
             raise ValueError('The chemical name is already in the Kinetic object')
+        self.index[name] = len(self.chemicals)
         self.chemicals += [name]
         self.concentrations += [concentration]
         self.chemical_stables += [stable]
@@ -57,103 +232,647 @@ class Kinetic:
         if self.flag_init:
             raise RuntimeError('Cannot add reaction after initialized')
         for name in inp:
-            if name not in self.chemicals:
+            if name not in self.index:
                 raise ValueError('The chemical name has not been added')
         for name in outp:
-            if name not in self.chemicals:
+            if name not in self.index:
                 raise ValueError('The chemical name has not been added')
         self.reaction_inputs += [inp]
         self.reaction_outputs += [outp]
         self.reaction_constants += [constant]
 
-    def init(self, num_of_steps = 1, check = False, criterion = None):
-        '''Initialize the variable necessary in the simulation'''
+    def init(self, num_of_steps = 1, check = False, criterion = None, sparse = None, compiled = False,
+             method = 'euler', rtol = 1e-6, atol = 1e-12, reduce = False):
+        '''Initialize the variable necessary in the simulation
+sparse: True to evaluate the rates from the compressed stoichiometry (cost scales with the number of nonzeros),
+False to use the dense matrices, None to choose automatically from the size and density of the network
+compiled: True to generate a function specialized for the network (with Numba when it is installed),
+it removes the per-step overhead of small networks
+method: 'euler' for num_of_steps fixed steps per cycle, 'adaptive' for the Dormand-Prince 5(4) pair
+or 'stiff' for the Rosenbrock 2(3) pair with the analytic Jacobian, the step size of these two is controlled by
+rtol and atol, num_of_steps and check are not used in this case
+reduce: find the conservation laws (left null space of the stoichiometry) and compute one dependent chemical
+of each law from the conserved total, the adaptive integrators only integrate the independent chemicals'''
         if self.flag_init:
             raise RuntimeError('Cannot reinitialize')
         if check and criterion == None:
             raise ValueError('Criterion is not given to check')
+        if method not in ('euler', 'adaptive', 'stiff'):
+            raise ValueError('Unknown integration method')
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
         self.check = check
         self.criterion = criterion
         self.flag_init = True
         self.num_of_steps = num_of_steps
         n_chem = len(self.chemicals)
         n_react = len(self.reaction_constants)
-        self.k = np.array(self.reaction_constants) # The constant with the delta multiplied in advance
-        self.inp_marker = np.zeros((n_react,n_chem)) # A matrix, each row is an reaction, each column is an chemical
+        self.k = np.array(self.reaction_constants, dtype = float) # The constant with the delta multiplied in advance
+        index = self.index
+        # Compressed (CSR) stoichiometry, one entry for each chemical appearing in a reaction
+        # ptr[i]:ptr[i+1] is the slice of reaction i in index (chemical) and order (number of times it appears)
+        self.inp_ptr, self.inp_index, self.inp_order = _compress(self.reaction_inputs, index)
+        self.outp_ptr, self.outp_index, self.outp_order = _compress(self.reaction_outputs, index)
+        if sparse == None:
+            nnz = len(self.inp_index) + len(self.outp_index)
+            sparse = n_react * n_chem > SPARSE_SIZE and nnz < SPARSE_DENSITY * n_react * n_chem
+        self.sparse = sparse
+        self.compiled = compiled
+        self._prepare()
+        self.times = np.array([0.0])
+        self.data = np.array(self.concentrations, dtype = float).reshape((1,n_chem)) # Matrix with each row is run, each column is a chemical
+        self.stables = np.array(self.chemical_stables, dtype = bool) # Convert to numpy object
+        self.reduce = reduce
+        if reduce:
+            self.conservation()
+
+    def _prepare(self):
+        '''Build the arrays derived from the compressed stoichiometry'''
+        n_react = len(self.k)
+        self.inp_reaction = np.repeat(np.arange(n_react), np.diff(self.inp_ptr)) # The reaction of each entry
+        self.outp_reaction = np.repeat(np.arange(n_react), np.diff(self.outp_ptr))
+        self.inp_nonempty = np.diff(self.inp_ptr) > 0 # Reactions having at least one reactant
+        self.inp_start = self.inp_ptr[:-1][self.inp_nonempty]
+        if self.sparse:
+            # The dense matrices are not built, they would be mostly zero
+            self.inp_marker = None
+            self.outp_marker = None
+        else:
+            self.inp_marker, self.outp_marker = self.markers()
+        if self.compiled:
+            self.kernel = compile_network(self.inp_ptr, self.inp_index, self.inp_order, self.outp_ptr,
+                                          self.outp_index, self.outp_order, self.chemical_stables, self.check)
+
+    def conservation(self):
+        '''Find the conservation laws of the chemicals that are not stable and choose the dependent chemicals
+Return the laws, each row is the coefficients of the chemicals of a conserved total'''
+        n_chem = len(self.chemicals)
+        free = np.nonzero(~self.stables)[0]
+        inp_marker, outp_marker = (self.inp_marker, self.outp_marker) if not self.sparse else self.markers()
+        basis, pivots = _pivot_rows(_null_space((outp_marker - inp_marker)[:,free]))
+        laws = np.zeros((len(basis), n_chem))
+        laws[:,free] = basis
+        self.dependent = free[pivots]
+        self.independent = np.setdiff1d(free, self.dependent)
+        self.link = laws[:,self.independent] # The laws are the identity on the dependent chemicals
+        self.totals = laws.dot(np.asarray(self.data[-1,:], dtype = float))
+        return laws
+
+    def expand(self, x, temp):
+        '''The full concentration from the independent chemicals x, the stable chemicals are taken from temp'''
+        temp = temp.copy()
+        temp[self.independent] = x
+        temp[self.dependent] = self.totals - self.link.dot(x)
+        return temp
+
+    def reduced_jacobian(self, temp):
+        '''The Jacobian of the independent chemicals, the dependent ones follow the conservation laws'''
+        jac = self.jacobian(temp)[self.independent]
+        return jac[:,self.independent] - jac[:,self.dependent].dot(self.link)
+
+    def markers(self):
+        '''Return the dense reactant and product matrices, each row is an reaction, each column is an chemical'''
+        n_chem = len(self.chemicals)
+        n_react = len(self.k)
+        inp_marker = np.zeros((n_react,n_chem))
         # Mark the reactant 1 for each time they appear
-        for i in range(n_react):
-            for name in self.reaction_inputs[i]:
-                self.inp_marker[i,self.chemicals.index(name)] += 1
+        inp_marker[self.inp_reaction, self.inp_index] = self.inp_order
         # The same with products
-        self.outp_marker = np.zeros((n_react,n_chem))
-        for i in range(n_react):
-            for name in self.reaction_outputs[i]:
-                self.outp_marker[i,self.chemicals.index(name)] += 1
-        self.times = np.array([0.0])
-        self.data = np.array(self.concentrations).reshape((1,n_chem)) # Matrix with each row is run, each column is a chemical
-        self.stables = np.array(self.chemical_stables) # Convert to numpy object
+        outp_marker = np.zeros((n_react,n_chem))
+        outp_marker[self.outp_reaction, self.outp_index] = self.outp_order
+        return inp_marker, outp_marker
+
+    def rate(self, temp, k):
+        '''The rate of each reaction at the concentration temp with the rate constants k'''
+        if not self.sparse:
+            return (temp ** self.inp_marker).prod(axis=1) * k
+        term = temp[self.inp_index] ** self.inp_order
+        prod = np.ones(len(self.k))
+        if len(self.inp_start) > 0:
+            prod[self.inp_nonempty] = np.multiply.reduceat(term, self.inp_start)
+        return prod * k
 
+    def change(self, rate):
+        '''The amount of each chemical consumed and formed by the reactions with the given rate'''
+        if not self.sparse:
+            change_outp = (self.outp_marker.T * rate).sum(axis = 1)
+            change_inp = (self.inp_marker.T * rate).sum(axis = 1)
+            return change_inp, change_outp
+        n_chem = len(self.chemicals)
+        change_outp = np.bincount(self.outp_index, rate[self.outp_reaction] * self.outp_order, n_chem)
+        change_inp = np.bincount(self.inp_index, rate[self.inp_reaction] * self.inp_order, n_chem)
+        return change_inp, change_outp
 
+    def batch_rate(self, temp, k):
+        '''The rate of each reaction for many sets of concentrations at once
+temp: (n_members, n_chem), k: (n_members, n_react) or (n_react,), return (n_members, n_react)'''
+        term = temp[:, self.inp_index] ** self.inp_order
+        prod = np.ones((len(temp), len(self.k)))
+        if len(self.inp_start) > 0:
+            prod[:, self.inp_nonempty] = np.multiply.reduceat(term, self.inp_start, axis = 1)
+        return prod * k
 
-    def run(self, cycle, delta):
-        ''' Run function '''
+    def batch_change(self, rate):
+        '''The amount consumed and formed for many sets of reaction rates, rate: (n_members, n_react)'''
+        if not self.sparse:
+            return rate.dot(self.inp_marker), rate.dot(self.outp_marker)
+        n_member = len(rate)
+        n_chem = len(self.chemicals)
+        offset = (np.arange(n_member) * n_chem)[:, None]
+        change_inp = np.bincount((offset + self.inp_index).ravel(), (rate[:, self.inp_reaction] * self.inp_order).ravel(),
+                                 n_member * n_chem).reshape((n_member, n_chem))
+        change_outp = np.bincount((offset + self.outp_index).ravel(), (rate[:, self.outp_reaction] * self.outp_order).ravel(),
+                                  n_member * n_chem).reshape((n_member, n_chem))
+        return change_inp, change_outp
+
+    def run_ensemble(self, concentrations = None, constants = None, cycle = 1, delta = 0.0, record_every = 1):
+        '''Run many copies of the network together with the Euler steps, the recorded data of the object is not changed
+concentrations: (n_members, n_chem) initial concentrations, None to use the last row of data for every member
+constants: (n_members, n_react) rate constants, None to use reaction_constants for every member
+Return an array (n_members, n_times, n_chem), the first time is the initial concentration
+and the others are every record_every cycles of delta, the last cycle is always kept'''
         if not self.flag_init:
             raise RuntimeError('You have to initialize before run')
-        self.flag_run = True
-        k = self.k * delta / self.num_of_steps
-        current, n_chem = self.data.shape
-        temp = self.times[-1] + np.arange(1,cycle+1)*delta
-        self.times = np.concatenate((self.times, temp), axis = 0)
-        temp = np.zeros((cycle, n_chem))
-        self.data = np.concatenate((self.data, temp), axis = 0)
-        temp = self.data[current-1,:]
+        n_chem = len(self.chemicals)
+        if concentrations is None:
+            temp = np.array(self.data[-1,:], dtype = float).reshape((1,n_chem))
+        else:
+            temp = np.array(concentrations, dtype = float).reshape((-1,n_chem))
+        if constants is None:
+            k = self.k.reshape((1,-1))
+        else:
+            k = np.array(constants, dtype = float).reshape((-1,len(self.k)))
+        n_member = max(len(temp), len(k))
+        temp = np.array(np.broadcast_to(temp, (n_member,n_chem)))
+        k = k * delta / self.num_of_steps
+        n_record = -(-cycle // record_every)
+        result = np.empty((n_member, n_record + 1, n_chem))
+        result[:,0,:] = temp
+        current = 1
         for i in range(cycle):
             for j in range(self.num_of_steps):
-                rate = (temp ** self.inp_marker).prod(axis=1) * k
-                change_outp = (self.outp_marker.T * rate).sum(axis = 1)
-                change_inp = (self.inp_marker.T * rate).sum(axis = 1)
-                change = np.where(self.stables, 0.0, change_outp - change_inp) # Do not change if the concentration is stable
-                # Check if the criterion is violated
-                # Only check for consumed amount, not forming amount
-                if self.check and np.where(temp != 0, np.abs(change_inp/temp) , 0.0).max() > self.criterion:
+                rate = self.batch_rate(temp, k)
+                change_inp, change_outp = self.batch_change(rate)
+                if self.check and np.where(temp != 0, np.abs(change_inp/np.where(temp != 0, temp, 1.0)), 0.0).max() > self.criterion:
                     raise ValueError('The change in one step is too large, decrease the step size')
-                temp = temp + change
-            self.data[current,:] = temp
-            current += 1
+                temp += np.where(self.stables, 0.0, change_outp - change_inp) # Do not change if the concentration is stable
+            if (i + 1) % record_every == 0 or i == cycle - 1:
+                result[:,current,:] = temp
+                current += 1
+        return result
+
+    def derivative(self, temp):
+        '''The time derivative of the concentration temp'''
+        change_inp, change_outp = self.change(self.rate(temp, self.k))
+        return np.where(self.stables, 0.0, change_outp - change_inp)
+
+    def jacobian(self, temp):
+        '''The Jacobian matrix of the time derivative at the concentration temp, J[i,j] = d(dc_i/dt)/dc_j
+The rows of the stable chemicals are zero'''
+        values = self._jacobian_terms(temp)
+        row, col = self.jac_pattern[2:4]
+        n_chem = len(self.chemicals)
+        jac = np.bincount(row * n_chem + col, values, n_chem * n_chem)
+        return jac.reshape((n_chem, n_chem))
+
+    def _jacobian_terms(self, temp):
+        '''Value of each term (row, col) of the Jacobian pattern at the concentration temp, the terms of the same
+position are added together'''
+        if self.jac_pattern == None:
+            self.jac_pattern = self._jacobian_pattern()
+        partner, other, row, col, coef, entry = self.jac_pattern
+        # Derivative of the rate of each reactant entry by its chemical, excluding the other reactants first
+        term = temp[self.inp_index] ** self.inp_order
+        partial = np.ones(len(self.inp_index))
+        np.multiply.at(partial, partner, term[other])
+        drate = self.k[self.inp_reaction] * self.inp_order * temp[self.inp_index] ** (self.inp_order - 1) * partial
+        return coef * drate[entry]
+
+    def _net_stoichiometry(self):
+        '''Nonzero entries (chemical, reaction, net change) of the stoichiometry, without the stable chemicals'''
+        n_react = len(self.k)
+        key = np.concatenate((self.outp_index * n_react + self.outp_reaction, self.inp_index * n_react + self.inp_reaction))
+        value = np.concatenate((self.outp_order, -self.inp_order)).astype(float)
+        key, inverse = np.unique(key, return_inverse = True)
+        value = np.bincount(inverse, value, len(key))
+        row = key // n_react
+        keep = (value != 0.0) & ~self.stables[row]
+        return row[keep], key[keep] % n_react, value[keep]
+
+    def _jacobian_pattern(self):
+        '''Index arrays of the Jacobian
+partner, other: pairs of different reactant entries of the same reaction
+row, col, coef, entry: chemical changed, chemical differentiated, net stoichiometry and reactant entry of each term'''
+        partner = []
+        other = []
+        row = []
+        col = []
+        coef = []
+        entry = []
+        for r in range(len(self.k)):
+            reactants = range(self.inp_ptr[r], self.inp_ptr[r+1])
+            net = {}
+            for e in range(self.outp_ptr[r], self.outp_ptr[r+1]):
+                net[self.outp_index[e]] = net.get(self.outp_index[e], 0.0) + self.outp_order[e]
+            for e in reactants:
+                net[self.inp_index[e]] = net.get(self.inp_index[e], 0.0) - self.inp_order[e]
+                for f in reactants:
+                    if e != f:
+                        partner.append(e)
+                        other.append(f)
+            for i in net:
+                if net[i] == 0.0 or self.stables[i]:
+                    continue
+                for e in reactants:
+                    row.append(i)
+                    col.append(self.inp_index[e])
+                    coef.append(net[i])
+                    entry.append(e)
+        return (np.array(partner, dtype = int), np.array(other, dtype = int), np.array(row, dtype = int),
+                np.array(col, dtype = int), np.array(coef, dtype = float), np.array(entry, dtype = int))
+
+    def run(self, cycle, delta, record_every = 1, steady = None, window = 10, callback = None, callback_every = 1,
+            profile = False, checkpoint = None, checkpoint_every = 60.0, sensitivity = False, normalize = False):
+        ''' Run function
+record_every: keep only every record_every cycles in data, the last cycle is always kept
+steady: stop early when the norm of the change in a cycle relative to the norm of the concentration
+is below steady for window cycles in a row, the time is kept in steady_time (None if not reached)
+callback: function(kinetic, cycles done, time, concentration) called every callback_every cycles,
+the run stops after the current cycle if it returns False or if cancel is called (from another thread)
+profile: also measure the time spent in the rate evaluations and the largest relative change in one step
+checkpoint: file name of the checkpoint written every checkpoint_every seconds (at a recorded cycle)
+and at the end of the run, see resume. If no stream is open, the trajectory is streamed to checkpoint + '.ptk'
+during the run, so each checkpoint only writes the rows since the previous one; that file is the trajectory
+to read after a crash, it is closed and read back into data when the run returns
+sensitivity: integrate d(concentration)/d(rate constant) with the Euler steps of the state, the result of the recorded
+rows (n_times, n_chem, n_react) is kept in sensitivity, the first row is the start of the run,
+normalize: scale it to d(ln concentration)/d(ln rate constant)
+The counters and timings of the run are kept in stats'''
+        if not self.flag_init:
+            raise RuntimeError('You have to initialize before run')
+        if sensitivity and self.method != 'euler':
+            raise ValueError('The sensitivity is only computed with the euler method')
+        own_stream = checkpoint != None and self.sink is None
+        if own_stream:
+            self.stream(checkpoint + storage.EXTENSION)
+        self.cancelled = False
+        try:
+            self._run(cycle, delta, record_every, steady, window, callback, callback_every, profile,
+                      checkpoint, checkpoint_every, sensitivity, normalize)
+        finally:
+            self.cancelled = False # A cancel only stops the run it was sent to
+            if own_stream:
+                # Give back the whole trajectory in data, as for a run without checkpoint
+                file_name = self.sink.file_name
+                self.close_stream()
+                chemicals, table = storage.load(file_name)
+                self.times = np.array(table[:,0])
+                self.data = np.array(table[:,1:])
+
+    def _run(self, cycle, delta, record_every, steady, window, callback, callback_every, profile,
+             checkpoint, checkpoint_every, sensitivity, normalize):
+        '''The integration of run, the arguments are the same'''
+        self.flag_run = True
+        k = self.k * delta / self.num_of_steps
+        start = self.times[-1]
+        temp = self.data[-1,:].copy()
+        n_record = -(-cycle // record_every)
+        if self.sink is not None:
+            n_record = min(n_record, self.block_size) # The rows are flushed to the file by blocks
+        self.reserve(n_record)
+        self.steady_time = None
+        n_steady = 0 # Number of cycles in a row below the steady criterion
+        stats = {'cycles': 0, 'substeps': 0, 'rejected': 0, 'rate_evaluations': 0, 'jacobian_evaluations': 0,
+                 'max_change': None, 'rate_time': None, 'wall_time': 0.0, 'wall_per_cycle': None, 'cancelled': False}
+        self.stats = stats
+        max_change = 0.0
+        rate_time = 0.0
+        derivative = self.derivative
+        jacobian = self.jacobian
+        y = temp # The state of the adaptive integrators, only the independent chemicals when reduced
+        if self.reduce and self.method != 'euler':
+            fixed = temp
+            derivative = lambda x: self.derivative(self.expand(x, fixed))[self.independent]
+            jacobian = lambda x: self.reduced_jacobian(self.expand(x, fixed))
+            y = temp[self.independent]
+        if profile:
+            full_derivative = derivative
+            full_jacobian = jacobian
+            def derivative(x):
+                begin = time.perf_counter()
+                value = full_derivative(x)
+                stats['rate_time'] += time.perf_counter() - begin
+                return value
+            def jacobian(x):
+                begin = time.perf_counter()
+                value = full_jacobian(x)
+                stats['rate_time'] += time.perf_counter() - begin
+                return value
+            stats['rate_time'] = 0.0
+        if not sensitivity:
+            self.sens_state = None # The state changes without it
+        if sensitivity:
+            if self.sens_state is None:
+                self.sens_state = np.zeros((len(self.chemicals), len(self.k)))
+            sens = self.sens_state
+            # J.S is computed from the sparse Jacobian terms grouped by row, the cost scales with nnz(J) * n_react
+            if self.jac_pattern == None:
+                self.jac_pattern = self._jacobian_pattern()
+            jac_row, jac_col = self.jac_pattern[2:4]
+            jac_order = np.argsort(jac_row, kind = 'stable')
+            jac_rows, jac_start = np.unique(jac_row[jac_order], return_index = True)
+            jac_stop = np.append(jac_start[1:], len(jac_order))
+            jac_col = jac_col[jac_order]
+            jac_rows = [(i, slice(a, b), jac_col[a:b]) for i, a, b in zip(jac_rows.tolist(), jac_start.tolist(), jac_stop.tolist())]
+            net_row, net_col, net_coef = self._net_stoichiometry()
+            step = delta / self.num_of_steps
+            recorded = [sens]
+            levels = [temp] # The concentration of the recorded rows, to normalize
+        begin_run = time.perf_counter()
+        last_checkpoint = begin_run
+        self.interrupted = None
+        if self.method != 'euler':
+            f = derivative(y)
+            stats['rate_evaluations'] += 1
+        for i in range(cycle):
+            previous = temp
+            # With the adaptive integrators the steps are chosen by the integrator, only the end of each cycle is recorded
+            if self.method == 'stiff':
+                y, f, self.step_size, accepted, rejected = rosenbrock23(derivative, jacobian, y, f, delta,
+                                                                        self.step_size, self.rtol, self.atol)
+                temp = self.expand(y, temp) if self.reduce else y
+                stats['rate_evaluations'] += 2 * (accepted + rejected)
+                stats['jacobian_evaluations'] += accepted
+            elif self.method == 'adaptive':
+                y, f, self.step_size, accepted, rejected = dopri5(derivative, y, f, delta,
+                                                                  self.step_size, self.rtol, self.atol)
+                temp = self.expand(y, temp) if self.reduce else y
+                stats['rate_evaluations'] += 6 * (accepted + rejected)
+            elif self.kernel is not None and not sensitivity:
+                temp = self.kernel(temp, k, self.num_of_steps, self.criterion)
+                if self.reduce:
+                    temp[self.dependent] = self.totals - self.link.dot(temp[self.independent])
+                accepted, rejected = self.num_of_steps, 0
+                stats['rate_evaluations'] += accepted
+            else:
+                for j in range(self.num_of_steps):
+                    if profile:
+                        begin = time.perf_counter()
+                    if sensitivity:
+                        prod = self.rate(temp, 1.0)
+                        rate = prod * k
+                    else:
+                        rate = self.rate(temp, k)
+                    change_inp, change_outp = self.change(rate)
+                    if profile:
+                        rate_time += time.perf_counter() - begin
+                    change = np.where(self.stables, 0.0, change_outp - change_inp) # Do not change if the concentration is stable
+                    # Check if the criterion is violated
+                    # Only check for consumed amount, not forming amount
+                    if self.check or profile:
+                        ratio = np.where(temp != 0, np.abs(change_inp/temp) , 0.0).max()
+                        max_change = max(max_change, ratio)
+                        if self.check and ratio > self.criterion:
+                            raise ValueError('The change in one step is too large, decrease the step size')
+                    if sensitivity:
+                        # d(dc/dt)/dk = J.S + net stoichiometry * rate / k
+                        dsens = np.zeros(sens.shape)
+                        terms = self._jacobian_terms(temp)[jac_order]
+                        for row, part, col in jac_rows:
+                            dsens[row] = terms[part].dot(sens[col])
+                        dsens[net_row, net_col] += net_coef * prod[net_col]
+                        sens = sens + step * dsens
+                    temp = temp + change
+                    if self.reduce:
+                        temp[self.dependent] = self.totals - self.link.dot(temp[self.independent])
+                        if sensitivity:
+                            sens[self.dependent] = -self.link.dot(sens[self.independent]) # The totals do not depend on k
+                accepted, rejected = self.num_of_steps, 0
+                stats['rate_evaluations'] += accepted
+            stats['cycles'] += 1
+            stats['substeps'] += accepted
+            stats['rejected'] += rejected
+            if steady != None:
+                if np.linalg.norm(temp - previous) <= steady * np.linalg.norm(temp):
+                    n_steady += 1
+                else:
+                    n_steady = 0
+                if n_steady >= window:
+                    self.steady_time = start + (i + 1) * delta
+            if callback is not None and (i + 1) % callback_every == 0:
+                if callback(self, i + 1, start + (i + 1) * delta, temp) == False:
+                    self.cancelled = True
+            stop = self.steady_time != None or self.cancelled
+            if (i + 1) % record_every == 0 or i == cycle - 1 or stop:
+                self.record(start + (i + 1) * delta, temp)
+                if sensitivity:
+                    recorded.append(sens)
+                    levels.append(temp)
+                if checkpoint != None and i < cycle - 1 and not stop and time.perf_counter() - last_checkpoint >= checkpoint_every:
+                    # The last recorded row is the current state, the rest of the run starts from it
+                    self.interrupted = {'cycle': cycle - i - 1, 'delta': delta, 'record_every': record_every,
+                                        'steady': steady, 'window': window, 'checkpoint_every': checkpoint_every,
+                                        'sensitivity': sensitivity, 'normalize': normalize}
+                    if sensitivity:
+                        self.sens_state = sens
+                    self.checkpoint(checkpoint)
+                    self.interrupted = None
+                    last_checkpoint = time.perf_counter()
+            if stop:
+                break
+        if self.sink is not None:
+            self.flush_stream()
+        if sensitivity:
+            self.sens_state = sens
+            self.sensitivity = np.array(recorded)
+            if normalize:
+                values = np.array(levels)
+                with np.errstate(divide = 'ignore'):
+                    self.sensitivity *= self.k[None,None,:] / np.where(values != 0.0, values, np.inf)[:,:,None]
+        if checkpoint != None:
+            self.checkpoint(checkpoint)
+        stats['wall_time'] = time.perf_counter() - begin_run
+        stats['wall_per_cycle'] = stats['wall_time'] / stats['cycles'] if stats['cycles'] > 0 else None
+        stats['cancelled'] = self.cancelled
+        # The compiled kernel does the steps at once, the change and the time of the rates are not measured
+        stepwise = self.method == 'euler' and (self.kernel is None or sensitivity)
+        if stepwise and (self.check or profile):
+            stats['max_change'] = float(max_change)
+        if profile and self.method == 'euler':
+            stats['rate_time'] = rate_time if stepwise else None
+
+    def cancel(self):
+        '''Ask the running run to stop after the current cycle, it can be called from another thread
+It has no effect if no run is running, a caller starting the run in a thread can return False from the callback'''
+        self.cancelled = True
+
+    def steady_state(self, tol = 1e-10, max_iter = 100):
+        '''Solve for the steady state with the Newton iteration, starting from the last row of data
+The stable chemicals are fixed and the conserved totals (left null space of the stoichiometry) are kept
+Return the concentrations, data is not changed'''
+        if not self.flag_init:
+            raise RuntimeError('You have to initialize before solve')
+        free = ~self.stables
+        temp = np.array(self.data[-1,:], dtype = float)
+        inp_marker, outp_marker = (self.inp_marker, self.outp_marker) if not self.sparse else self.markers()
+        laws = _null_space((outp_marker - inp_marker)[:,free]) # Each row is a conserved combination of free chemicals
+        total = laws.dot(temp[free])
+        residual = self.derivative(temp)[free]
+        for iteration in range(max_iter):
+            if np.linalg.norm(residual) <= tol * max(np.linalg.norm(temp), 1.0):
+                return temp
+            matrix = np.vstack((self.jacobian(temp)[free][:,free], laws))
+            rhs = np.concatenate((-residual, total - laws.dot(temp[free])))
+            step = np.linalg.lstsq(matrix, rhs, rcond = None)[0]
+            # Damped step, halve it until the residual decreases
+            scale = 1.0
+            while True:
+                trial = temp.copy()
+                trial[free] += scale * step
+                trial_residual = self.derivative(trial)[free]
+                if np.linalg.norm(trial_residual) < np.linalg.norm(residual) or scale < 1e-6:
+                    break
+                scale /= 2.0
+            temp = trial
+            residual = trial_residual
+        if np.linalg.norm(residual) <= tol * max(np.linalg.norm(temp), 1.0):
+            return temp
+        raise ValueError('The steady state is not found, increase max_iter or start closer to it')
+
+    def checkpoint(self, file_name):
+        '''Save the network, the settings, the integrator state and the data to a binary file
+The file is replaced atomically, the previous checkpoint stays valid if the writing fails
+When streaming, the rows are flushed to the stream and only its position is saved'''
+        if not self.flag_init:
+            raise RuntimeError('You have to initialize before checkpoint')
+        settings = {'chemicals': list(self.chemicals), 'concentrations': [float(x) for x in self.concentrations],
+                    'chemical_stables': [bool(x) for x in self.chemical_stables],
+                    'reaction_inputs': [list(x) for x in self.reaction_inputs],
+                    'reaction_outputs': [list(x) for x in self.reaction_outputs],
+                    'reaction_constants': [float(x) for x in self.reaction_constants],
+                    'num_of_steps': self.num_of_steps, 'check': self.check, 'criterion': self.criterion,
+                    'sparse': bool(self.sparse), 'compiled': self.compiled, 'method': self.method,
+                    'rtol': self.rtol, 'atol': self.atol, 'step_size': self.step_size, 'reduce': self.reduce,
+                    'flag_run': self.flag_run, 'steady_time': self.steady_time, 'interrupted': self.interrupted,
+                    'stream': None}
+        arrays = {'times': self.times, 'data': self.data, 'k': self.k, 'stables': self.stables,
+                  'inp_ptr': self.inp_ptr, 'inp_index': self.inp_index, 'inp_order': self.inp_order,
+                  'outp_ptr': self.outp_ptr, 'outp_index': self.outp_index, 'outp_order': self.outp_order}
+        if self.sens_state is not None:
+            arrays['sens_state'] = self.sens_state
+        if self.reduce:
+            arrays.update({'dependent': self.dependent, 'independent': self.independent,
+                           'link': self.link, 'totals': self.totals})
+        if self.sink is not None:
+            self.flush_stream()
+            settings['stream'] = {'file_name': os.path.abspath(self.sink.file_name), 'rows': self.sink.tell(),
+                                  'block_size': self.block_size}
+        temp_name = file_name + '.tmp'
+        with open(temp_name, 'wb') as f:
+            np.savez(f, settings = np.array(json.dumps(settings)), **arrays)
+        os.replace(temp_name, file_name)
+
+    @classmethod
+    def resume(cls, file_name):
+        '''Create the Kinetic object saved by checkpoint, ready to run again
+If the checkpoint was written during a run, resume_run finishes that run'''
+        with np.load(file_name) as saved:
+            settings = json.loads(str(saved['settings']))
+            arrays = {name: saved[name] for name in saved.files if name != 'settings'}
+        obj = cls()
+        for name in ('chemicals', 'concentrations', 'chemical_stables', 'reaction_inputs', 'reaction_outputs',
+                     'reaction_constants', 'num_of_steps', 'check', 'criterion', 'sparse', 'compiled', 'method',
+                     'rtol', 'atol', 'step_size', 'reduce', 'flag_run', 'steady_time', 'interrupted'):
+            setattr(obj, name, settings[name])
+        for name in ('k', 'stables', 'inp_ptr', 'inp_index', 'inp_order', 'outp_ptr', 'outp_index', 'outp_order',
+                     'dependent', 'independent', 'link', 'totals', 'sens_state'):
+            if name in arrays:
+                setattr(obj, name, arrays[name])
+        obj.index = {name: i for i, name in enumerate(obj.chemicals)}
+        obj.flag_init = True
+        obj._prepare()
+        obj.data = arrays['data']
+        obj.times = arrays['times']
+        stream = settings['stream']
+        if stream != None:
+            obj.sink = storage.TrajectoryWriter(stream['file_name'], obj.chemicals, stream['rows'])
+            obj.block_size = stream['block_size']
+            obj.written = obj.size # The rows in memory are already in the file
+        return obj
+
+    def resume_run(self, checkpoint = None):
+        '''Finish the run interrupted after the checkpoint it was resumed from'''
+        if self.interrupted == None:
+            raise RuntimeError('There is no interrupted run to resume')
+        args = dict(self.interrupted)
+        self.interrupted = None
+        self.run(checkpoint = checkpoint, **args)
 
     def reset(self):
-        '''Free the data and figure, keep only the last concentration'''
-        self.data = self.data[-1,:]
-        self.times = self.times[[-1]]
-        for fig in self.fig:
-            plt.close(fig)
+        '''Free the data, the sensitivities and the figure, keep only the last concentration'''
+        data = self.data[[-1],:].copy()
+        times = self.times[[-1]].copy()
+        self.data = data
+        self.times = times
+        self.sens_state = None # Only valid for the state it was integrated with
+        self.sensitivity = None
+        if len(self.fig) > 0:
+            import matplotlib.pyplot as plt
+            for fig in self.fig:
+                plt.close(fig)
+        self.fig = []
 
     def save(self,file_name):
-        '''Save the data to a csv file'''
+        '''Save the data to a csv file, or to a binary trajectory if the file name ends with .ptk'''
+        if storage.is_binary(file_name):
+            storage.save(file_name, self.chemicals, self.times, self.data)
+            return
+        import pandas as pd
         data = pd.DataFrame(self.data,columns = self.chemicals, index = self.times)
         data.to_csv(file_name)
 
     def read(self, file_name):
-        data = pd.read_csv(file_name, index_col = 0)
-        self.data = data.values
-        self.chemicals = self.data.columns
-        self.times = self.data.index
+        '''Read the data saved by save, a binary trajectory (.ptk) is opened as a memory map,
+the rows are only read from the disk when they are accessed'''
+        if storage.is_binary(file_name):
+            chemicals, table = storage.load(file_name)
+            times = table[:,0]
+            data = table[:,1:]
+        else:
+            import pandas as pd
+            frame = pd.read_csv(file_name, index_col = 0)
+            chemicals = list(frame.columns)
+            times = frame.index.values.astype(float)
+            data = frame.values.astype(float)
+        self.chemicals = chemicals
+        self.index = {name: i for i, name in enumerate(chemicals)}
+        self.data = data
+        self.times = times
         self.flag_run = True
 
-    def plot(self, chemical = None):
-        ''' Plot the concentration '''
+    def select(self, chemical = None, start = None, end = None):
+        '''Return the times and the concentrations of the given chemical names between the time start and end
+Only the rows in the range are read, so it is cheap on a memory-mapped trajectory'''
+        times = self.times
+        # Binary search reading one element at a time, np.searchsorted would copy the whole column
+        low = 0 if start == None else bisect.bisect_left(times, start)
+        high = len(times) if end == None else bisect.bisect_right(times, end)
+        if chemical == None:
+            return times[low:high], self.data[low:high]
+        return times[low:high], self.data[low:high][:, [self.index[x] for x in chemical]]
+
+    def plot(self, chemical = None, max_points = None, reuse = False):
+        ''' Plot the concentration
+max_points: number of points of each line, None for about two per pixel, zooming decimates again from the full data
+reuse: update the last figure of this object in place instead of creating a new one'''
         if not self.flag_run:
             raise RuntimeError('You have to run before plot')
-        n_chem = self.data.shape[1]
-        fig = plt.figure()
-        ax = fig.add_subplot(1,1,1)
-        if chemical == None:
-            ind = range(n_chem) # Plot all the concentration
-        else:
-            ind = [self.chemicals.index(x) for x in chemical] # Plot the concentration given by chemical argument
-        color_map = cm.rainbow(np.linspace(0,1,len(ind))) # Continuous rainbow color
-        for i,j in enumerate(ind):
-            temp, = ax.plot(self.times, self.data[:,j], c=color_map[i],label = self.chemicals[j])
-        ax.legend()
-        fig.show()
-        self.fig += [fig] # Save the figure to delete
+        from . import plotting
+        fig = self.fig[-1] if reuse and len(self.fig) > 0 else None
+        new = fig is None
+        fig = plotting.plot(self, chemical, max_points, fig)
+        if new:
+            fig.show()
+            self.fig += [fig] # Save the figure to delete
+        return fig
@@ -0,0 +1,123 @@
+'''
+ptkinetic package
+Reaction-diffusion of a Kinetic network on a 1D or 2D grid of cells
+The state is an array (n_cells, n_chem), the rates of all the cells are evaluated together with
+Kinetic.batch_rate and Kinetic.batch_change, by blocks of cells to keep the temporary arrays small
+Diffusion is the standard finite difference stencil (2 * dim + 1 points), it is applied exactly in Fourier space,
+so a step of any size is stable, and combined with the reaction by Strang splitting
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import numpy as np
+
+class ReactionDiffusion:
+    '''Run the network of an initialized Kinetic object at every cell of a grid, with diffusion between the cells
+The stable chemicals do not react nor diffuse, they are fixed fields which can vary in space (see set)'''
+    def __init__(self, kinetic, shape, diffusion, dx = 1.0, boundary = 'periodic', block_size = 16384):
+        '''shape: number of cells, an int or a tuple of one or two ints
+diffusion: dictionary {chemical name: diffusion coefficient} or a sequence of n_chem coefficients,
+the missing chemicals do not diffuse
+dx: spacing of the cells, one number or one per dimension
+boundary: 'periodic' or 'neumann' (no flux through the border)
+block_size: number of cells whose rates are evaluated together'''
+        if not kinetic.flag_init:
+            raise RuntimeError('You have to initialize the Kinetic object first')
+        if boundary not in ('periodic', 'neumann'):
+            raise ValueError('Unknown boundary condition')
+        self.kinetic = kinetic
+        self.shape = (shape,) if np.isscalar(shape) else tuple(shape)
+        if len(self.shape) not in (1, 2):
+            raise ValueError('The grid must have one or two dimensions')
+        self.n_cells = int(np.prod(self.shape))
+        n_chem = len(kinetic.chemicals)
+        self.diffusion = np.zeros(n_chem)
+        if isinstance(diffusion, dict):
+            for name, value in diffusion.items():
+                if name not in kinetic.index:
+                    raise ValueError('The chemical name has not been added')
+                self.diffusion[kinetic.index[name]] = value
+        else:
+            self.diffusion[:] = diffusion
+        self.diffusion[kinetic.stables] = 0.0 # Fixed fields
+        self.diffusing = np.nonzero(self.diffusion)[0]
+        self.dx = np.broadcast_to(np.asarray(dx, dtype = float), (len(self.shape),))
+        self.boundary = boundary
+        self.block_size = block_size
+        self._factors = {} # exp(D * eigenvalue * dt) of the diffusing chemicals, the key is dt
+        self.state = np.tile(np.asarray(kinetic.data[-1,:], dtype = float), (self.n_cells, 1))
+        self.time = 0.0
+        self.times = [] # Recorded times
+        self.data = [] # Recorded states (n_cells, n_chem)
+
+    def set(self, chemical, values):
+        '''Set the concentration of a chemical at every cell, values is a number or an array of the grid shape'''
+        i = self.kinetic.index[chemical]
+        self.state[:, i] = np.broadcast_to(values, self.shape).ravel()
+
+    def field(self, chemical, row = None):
+        '''Concentration of a chemical on the grid, row: a recorded state, None for the current one'''
+        state = self.state if row == None else self.data[row]
+        return state[:, self.kinetic.index[chemical]].reshape(self.shape)
+
+    def _factor(self, dt):
+        '''exp(D * eigenvalue * dt) of the stencil along each axis for the frequencies of np.fft.rfft,
+shape (n_frequencies, n_diffusing) moved to the position of the axis'''
+        if dt not in self._factors:
+            factors = []
+            dim = len(self.shape)
+            for axis, (n, h) in enumerate(zip(self.shape, self.dx)):
+                if self.boundary == 'neumann':
+                    n = 2 * n # Mirror extension
+                eigen = (2.0 * np.cos(2.0 * np.pi * np.fft.rfftfreq(n)) - 2.0) / h ** 2
+                factor = np.exp(np.multiply.outer(eigen, self.diffusion[self.diffusing] * dt))
+                factors.append(factor.reshape((len(eigen),) + (1,) * (dim - 1 - axis) + (len(self.diffusing),)))
+            self._factors[dt] = factors
+        return self._factors[dt]
+
+    def diffuse(self, dt):
+        '''Advance the diffusion by dt exactly for the stencil, one axis at a time (the Laplacian is separable)'''
+        if len(self.diffusing) == 0 or dt == 0.0:
+            return
+        x = self.state[:, self.diffusing].reshape(self.shape + (len(self.diffusing),))
+        for axis, (n, factor) in enumerate(zip(self.shape, self._factor(dt))):
+            if self.boundary == 'neumann':
+                # The mirror image makes the periodic stencil equal to the one with zero flux at the border
+                x = np.concatenate((x, np.flip(x, axis)), axis)
+                x = np.fft.irfft(np.fft.rfft(x, axis = axis) * factor, 2 * n, axis = axis)
+                x = x[(slice(None),) * axis + (slice(0, n),)]
+            else:
+                x = np.fft.irfft(np.fft.rfft(x, axis = axis) * factor, n, axis = axis)
+        self.state[:, self.diffusing] = x.reshape((self.n_cells, len(self.diffusing)))
+
+    def react(self, dt):
+        '''Advance the reactions by dt with num_of_steps Euler steps of the Kinetic object in every cell'''
+        kinetic = self.kinetic
+        k = kinetic.k * dt / kinetic.num_of_steps
+        for start in range(0, self.n_cells, self.block_size):
+            temp = self.state[start:start + self.block_size] # A view, changed in place
+            for j in range(kinetic.num_of_steps):
+                change_inp, change_outp = kinetic.batch_change(kinetic.batch_rate(temp, k))
+                if kinetic.check and np.where(temp != 0, np.abs(change_inp/np.where(temp != 0, temp, 1.0)), 0.0).max() > kinetic.criterion:
+                    raise ValueError('The change in one step is too large, decrease the step size')
+                temp += np.where(kinetic.stables, 0.0, change_outp - change_inp)
+
+    def run(self, cycle, delta, record_every = 1):
+        '''Run cycle steps of delta with Strang splitting: half a diffusion step, the reactions, half a diffusion step
+The half steps between two cycles are merged into one full diffusion step
+The state is recorded at the start and every record_every cycles, the last cycle is always kept'''
+        if len(self.times) == 0:
+            self.times.append(self.time)
+            self.data.append(self.state.copy())
+        self.diffuse(delta / 2.0)
+        for i in range(cycle):
+            self.react(delta)
+            self.time += delta
+            if (i + 1) % record_every == 0 or i == cycle - 1:
+                # Finish the step to record it
+                self.diffuse(delta / 2.0)
+                self.times.append(self.time)
+                self.data.append(self.state.copy())
+                if i < cycle - 1:
+                    self.diffuse(delta / 2.0)
+            else:
+                self.diffuse(delta)
@@ -0,0 +1,213 @@
+'''
+ptkinetic package
+Stochastic simulation of the network of a Kinetic object
+The exact simulation uses the next reaction method of Gibson and Bruck: the firing times are kept
+in an indexed priority queue and only the propensities depending on the fired reaction are updated
+The approximate simulation uses tau leaping, vectorized over the trajectories
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import math
+
+import numpy as np
+
+class Stochastic:
+    '''Stochastic simulation, the state is the number of molecules of each chemical
+The concentrations of the Kinetic object are multiplied by volume and rounded, and the propensity of a reaction
+with rate constant k is k * volume ** (1 - order) * product of x * (x - 1) * ... for each reactant'''
+    def __init__(self, kinetic, volume = 1.0):
+        '''Build the propensity constants and the dependency graph from an initialized Kinetic object'''
+        if not kinetic.flag_init:
+            raise RuntimeError('You have to initialize the Kinetic object first')
+        self.kinetic = kinetic
+        self.volume = volume
+        n_chem = len(kinetic.chemicals)
+        n_react = len(kinetic.k)
+        self.stables = kinetic.stables
+        order = np.bincount(kinetic.inp_reaction, kinetic.inp_order, n_react)
+        self.c = kinetic.k * float(volume) ** (1.0 - order) # Propensity constants
+        # Reactants (chemical, order) of each reaction
+        self.reactants = [[(int(kinetic.inp_index[e]), int(kinetic.inp_order[e]))
+                           for e in range(kinetic.inp_ptr[r], kinetic.inp_ptr[r+1])] for r in range(n_react)]
+        # Net change (chemical, amount) of each reaction, the stable chemicals are not changed
+        self.nu = np.zeros((n_react, n_chem))
+        np.add.at(self.nu, (kinetic.outp_reaction, kinetic.outp_index), kinetic.outp_order)
+        np.add.at(self.nu, (kinetic.inp_reaction, kinetic.inp_index), -kinetic.inp_order)
+        self.nu[:, self.stables] = 0.0
+        self.changes = [[(int(i), float(self.nu[r,i])) for i in np.nonzero(self.nu[r])[0]] for r in range(n_react)]
+        # Dependency graph: the reactions whose propensity changes when reaction r fires
+        consumers = [[] for i in range(n_chem)]
+        for r in range(n_react):
+            for i, n in self.reactants[r]:
+                consumers[i].append(r)
+        self.depends = [sorted(set(s for i, amount in self.changes[r] for s in consumers[i])) for r in range(n_react)]
+        self.max_order = np.zeros(n_chem) # Highest order of each chemical as reactant, for the tau selection
+        np.maximum.at(self.max_order, kinetic.inp_index, kinetic.inp_order)
+
+    def initial(self):
+        '''The numbers of molecules from the last row of the Kinetic data'''
+        return np.rint(np.asarray(self.kinetic.data[-1,:], dtype = float) * self.volume)
+
+    def propensity(self, x, r):
+        '''Propensity of reaction r for the numbers of molecules x'''
+        a = self.c[r]
+        for i, n in self.reactants[r]:
+            for m in range(n):
+                a *= x[i] - m
+        return a
+
+    def batch_propensity(self, x):
+        '''Propensities (n_traj, n_react) for the numbers of molecules x (n_traj, n_chem)'''
+        a = np.tile(self.c, (len(x), 1))
+        for r in range(len(self.c)):
+            for i, n in self.reactants[r]:
+                for m in range(n):
+                    a[:,r] *= np.maximum(x[:,i] - m, 0.0)
+        return a
+
+    def run(self, times, n_traj = 1, seed = None, method = 'next', tau = None, epsilon = 0.03):
+        '''Simulate n_traj trajectories and record the numbers of molecules at times (from 0, increasing)
+method: 'next' for the exact next reaction method, 'tau' for tau leaping
+tau: the fixed leap for tau leaping, None to select it from epsilon (relative change of the propensities)
+seed: the trajectories are reproducible for the same seed and n_traj
+Return an array (n_traj, n_times, n_chem)'''
+        times = np.asarray(times, dtype = float)
+        if method == 'next':
+            seeds = np.random.SeedSequence(seed).spawn(n_traj) # An independent stream for each trajectory
+            return np.array([self._next_reaction(times, np.random.default_rng(s)) for s in seeds])
+        if method == 'tau':
+            return self._tau_leaping(times, np.random.default_rng(seed), n_traj, tau, epsilon)
+        raise ValueError('Unknown stochastic method')
+
+    def _next_reaction(self, times, rng):
+        '''One trajectory with the next reaction method'''
+        n_react = len(self.c)
+        x = self.initial().tolist()
+        result = np.empty((len(times), len(x)))
+        exponential = _Exponential(rng)
+        propensity = [self.propensity(x, r) for r in range(n_react)]
+        fire = [exponential.next() / a if a > 0.0 else math.inf for a in propensity]
+        queue = IndexedQueue(fire)
+        t = 0.0
+        for n, t_out in enumerate(times):
+            while n_react > 0 and queue.key[queue.heap[0]] <= t_out:
+                r = queue.heap[0]
+                t = queue.key[r]
+                for i, amount in self.changes[r]:
+                    x[i] += amount
+                for s in self.depends[r]:
+                    old = propensity[s]
+                    new = self.propensity(x, s)
+                    propensity[s] = new
+                    if new <= 0.0:
+                        queue.update(s, math.inf)
+                    elif s != r and old > 0.0:
+                        queue.update(s, t + old / new * (queue.key[s] - t)) # Rescale the remaining waiting time
+                    else:
+                        queue.update(s, t + exponential.next() / new)
+                if r not in self.depends[r]:
+                    queue.update(r, t + exponential.next() / propensity[r] if propensity[r] > 0.0 else math.inf)
+            result[n] = x
+        return result
+
+    def _tau_leaping(self, times, rng, n_traj, tau, epsilon):
+        '''All trajectories together with tau leaping, the leap is halved for a trajectory going negative'''
+        x = np.tile(self.initial(), (n_traj, 1))
+        result = np.empty((n_traj, len(times), x.shape[1]))
+        t = np.zeros(n_traj)
+        for n, t_out in enumerate(times):
+            while True:
+                pending = np.nonzero(t < t_out)[0]
+                if len(pending) == 0:
+                    break
+                a = self.batch_propensity(x[pending])
+                if tau == None:
+                    step = self._select_tau(x[pending], a, epsilon)
+                else:
+                    step = np.full(len(pending), float(tau))
+                remain = t_out - t[pending]
+                last = step >= remain
+                step = np.where(last, remain, step)
+                while len(pending) > 0:
+                    new = x[pending] + rng.poisson(a * step[:,None]).dot(self.nu)
+                    accept = ~(new < 0.0).any(axis = 1)
+                    done = pending[accept]
+                    x[done] = new[accept]
+                    t[done] = np.where(last[accept], t_out, t[done] + step[accept]) # Land exactly on the output time
+                    # The rejected trajectories try again with half of the leap
+                    pending = pending[~accept]
+                    a = a[~accept]
+                    step = step[~accept] / 2.0
+                    last = np.zeros(len(pending), dtype = bool)
+            result[:,n,:] = x
+        return result
+
+    def _select_tau(self, x, a, epsilon):
+        '''Leap of Cao, Gillespie and Petzold keeping the relative change of each chemical below epsilon'''
+        mean = np.abs(a.dot(self.nu))
+        variance = a.dot(self.nu ** 2)
+        bound = np.maximum(epsilon * x / np.maximum(self.max_order, 1.0), 1.0)
+        with np.errstate(divide = 'ignore'):
+            step = np.minimum(bound / mean, bound ** 2 / variance)
+        step = np.where((mean > 0.0) | (variance > 0.0), step, np.inf)
+        return step.min(axis = 1)
+
+class _Exponential:
+    '''Standard exponential numbers drawn by blocks'''
+    def __init__(self, rng, block = 4096):
+        self.rng = rng
+        self.block = block
+        self.values = []
+        self.index = 0
+
+    def next(self):
+        if self.index >= len(self.values):
+            self.values = self.rng.standard_exponential(self.block).tolist()
+            self.index = 0
+        self.index += 1
+        return self.values[self.index - 1]
+
+class IndexedQueue:
+    '''Binary heap of the items 0..n-1 ordered by key, with the position of each item to update it in place'''
+    def __init__(self, key):
+        self.key = list(key)
+        self.heap = sorted(range(len(self.key)), key = lambda i: self.key[i])
+        self.position = [0] * len(self.key)
+        for p, i in enumerate(self.heap):
+            self.position[i] = p
+
+    def update(self, item, key):
+        '''Change the key of item and restore the heap'''
+        old = self.key[item]
+        self.key[item] = key
+        if key < old:
+            self._up(self.position[item])
+        elif key > old:
+            self._down(self.position[item])
+
+    def _swap(self, p, q):
+        heap = self.heap
+        heap[p], heap[q] = heap[q], heap[p]
+        self.position[heap[p]] = p
+        self.position[heap[q]] = q
+
+    def _up(self, p):
+        while p > 0:
+            parent = (p - 1) // 2
+            if self.key[self.heap[parent]] <= self.key[self.heap[p]]:
+                break
+            self._swap(p, parent)
+            p = parent
+
+    def _down(self, p):
+        n = len(self.heap)
+        while True:
+            child = 2 * p + 1
+            if child >= n:
+                break
+            if child + 1 < n and self.key[self.heap[child + 1]] < self.key[self.heap[child]]:
+                child += 1
+            if self.key[self.heap[p]] <= self.key[self.heap[child]]:
+                break
+            self._swap(p, child)
+            p = child
@@ -0,0 +1,90 @@
+'''
+ptkinetic package
+Binary trajectory file, written by blocks during Kinetic.run and read back as a memory map
+Layout: MAGIC, the header length (uint32, little endian), the JSON header padded with spaces
+so that the rows start at a multiple of ALIGN bytes, then the rows (time, concentrations) as float64
+The number of rows is given by the file size, so rows can be appended at any time
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'PTKINET1'
+ALIGN = 64
+EXTENSION = '.ptk'
+DTYPE = np.dtype('<f8')
+
+class TrajectoryWriter:
+    '''Append (time, concentrations) rows to a binary trajectory file'''
+    def __init__(self, file_name, chemicals, rows = None):
+        '''Create the file and write the header, an existing file is overwritten
+rows: continue an existing file after its first rows rows, the rows after them are discarded'''
+        self.file_name = file_name
+        self.n_column = len(chemicals) + 1
+        if rows != None:
+            header, offset = read_header(file_name)
+            self.file = open(file_name, 'r+b')
+            self.file.truncate(offset + rows * self.n_column * DTYPE.itemsize)
+            self.file.seek(0, 2)
+            self.rows = rows
+            return
+        header = json.dumps({'chemicals': list(chemicals), 'dtype': DTYPE.str}).encode('utf-8')
+        length = len(header) + (-(len(MAGIC) + 4 + len(header)) % ALIGN)
+        self.file = open(file_name, 'wb')
+        self.file.write(MAGIC + struct.pack('<I', length) + header.ljust(length))
+        self.rows = 0
+
+    def tell(self):
+        '''Number of rows in the file'''
+        return self.rows
+
+    def write(self, times, data):
+        '''Append the rows, times: (n,) and data: (n, n_chem)'''
+        block = np.empty((len(times), self.n_column), dtype = DTYPE)
+        block[:,0] = times
+        block[:,1:] = data
+        self.file.write(block.tobytes())
+        self.rows += len(block)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def read_header(file_name):
+    '''Return the header dictionary and the offset of the first row'''
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('The file is not a ptkinetic trajectory')
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header, len(MAGIC) + 4 + length
+
+def load(file_name):
+    '''Open the trajectory as a read-only memory map, nothing is read until the rows are accessed
+Return the chemical names and the table (n_rows, 1 + n_chem), the first column is the time'''
+    header, offset = read_header(file_name)
+    n_column = len(header['chemicals']) + 1
+    dtype = np.dtype(header['dtype'])
+    with open(file_name, 'rb') as f:
+        f.seek(0, 2)
+        n_row = (f.tell() - offset) // (n_column * dtype.itemsize) # An incomplete last row is ignored
+    if n_row == 0:
+        table = np.empty((0, n_column), dtype = dtype)
+    else:
+        table = np.memmap(file_name, dtype = dtype, mode = 'r', offset = offset, shape = (n_row, n_column))
+    return header['chemicals'], table
+
+def is_binary(file_name):
+    '''True if the file name has the binary trajectory extension'''
+    return str(file_name).endswith(EXTENSION)
+
+def save(file_name, chemicals, times, data):
+    '''Write the whole trajectory at once'''
+    writer = TrajectoryWriter(file_name, chemicals)
+    writer.write(times, data)
+    writer.close()
@@ -0,0 +1,104 @@
+'''
+ptkinetic package
+Run a parameter sweep of a Kinetic network over a process pool
+Each worker runs a chunk of members with Kinetic.run_ensemble and writes it directly
+to a memory-mapped result array, so the trajectories are never pickled back
+Source: https://github.com/zeldery/ptkinetic
+'''
+
+import os
+import copy
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+_worker = {} # State of the worker process, set by _init_worker
+
+def _network(kinetic):
+    '''A shallow copy of the Kinetic object with only the last recorded row, sent to the workers instead of
+the whole recorded trajectory and sensitivities'''
+    model = copy.copy(kinetic)
+    model.times = kinetic.times[[-1]].copy()
+    model.data = kinetic.data[[-1],:].copy()
+    model.sensitivity = None
+    model.sens_state = None
+    model.stats = {}
+    return model
+
+def _init_worker(kinetic, concentrations, constants, file_name, run_args):
+    '''Keep the model and inputs in the worker and open the result file'''
+    _worker['kinetic'] = kinetic
+    _worker['concentrations'] = concentrations
+    _worker['constants'] = constants
+    _worker['result'] = np.load(file_name, mmap_mode = 'r+')
+    _worker['run_args'] = run_args
+
+def _run_chunk(bounds):
+    '''Run the members start:stop and write them to the result'''
+    start, stop = bounds
+    concentrations = _worker['concentrations']
+    constants = _worker['constants']
+    result = _worker['result']
+    result[start:stop] = _worker['kinetic'].run_ensemble(
+        None if concentrations is None else concentrations[start:stop],
+        None if constants is None else constants[start:stop],
+        *_worker['run_args'])
+    result.flush()
+    return start
+
+def sweep(kinetic, concentrations = None, constants = None, cycle = 1, delta = 0.0, record_every = 1,
+          processes = None, chunk_size = None, file_name = None):
+    '''Run one member per row of concentrations (n_members, n_chem) and constants (n_members, n_react)
+over a pool of processes, the arguments are the same as Kinetic.run_ensemble
+processes: number of worker processes, None for all the cores, 1 to run in this process
+chunk_size: number of members run together by a worker, None to give about 4 chunks per process
+file_name: the .npy file receiving the result, which is returned as a memory map,
+None to use a temporary file and return the result in memory
+Return (n_members, n_times, n_chem), row i is always the member i whatever the order the chunks finish'''
+    if not kinetic.flag_init:
+        raise RuntimeError('You have to initialize before run')
+    n_chem = len(kinetic.chemicals)
+    if concentrations is not None:
+        concentrations = np.array(concentrations, dtype = float).reshape((-1,n_chem))
+    if constants is not None:
+        constants = np.array(constants, dtype = float).reshape((-1,len(kinetic.k)))
+    if concentrations is None and constants is None:
+        raise ValueError('Either concentrations or constants has to be given')
+    n_member = max(len(x) for x in (concentrations, constants) if x is not None)
+    for x in (concentrations, constants):
+        if x is not None and len(x) != n_member:
+            raise ValueError('concentrations and constants must have the same number of rows')
+    if processes == None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, n_member))
+    if chunk_size == None:
+        chunk_size = max(1, -(-n_member // (4 * processes)))
+    chunks = [(i, min(i + chunk_size, n_member)) for i in range(0, n_member, chunk_size)]
+    run_args = (cycle, delta, record_every)
+    shape = (n_member, -(-cycle // record_every) + 1, n_chem)
+    temporary = file_name == None
+    if temporary:
+        folder = '/dev/shm' if os.path.isdir('/dev/shm') else None # Shared memory file system when available
+        handle, file_name = tempfile.mkstemp(suffix = '.npy', dir = folder)
+        os.close(handle)
+    result = None
+    try:
+        result = np.lib.format.open_memmap(file_name, mode = 'w+', shape = shape)
+        if processes == 1:
+            _init_worker(kinetic, concentrations, constants, file_name, run_args)
+            for bounds in chunks:
+                _run_chunk(bounds)
+            _worker.clear()
+        else:
+            with multiprocessing.Pool(processes, _init_worker,
+                                      (_network(kinetic), concentrations, constants, file_name, run_args)) as pool:
+                for start in pool.imap_unordered(_run_chunk, chunks):
+                    pass
+        if temporary:
+            return np.array(result)
+        return result
+    finally:
+        if temporary:
+            del result # Close the memory map before removing the file
+            os.remove(file_name)
@@ -1,10 +1,49 @@
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QLineEdit, QPushButton,
                             QGridLayout, QGroupBox, QVBoxLayout, QListWidget,
-                            QCheckBox, QMessageBox)
+                            QCheckBox, QMessageBox, QProgressBar)
+from PyQt5.QtCore import QThread, pyqtSignal
+import numpy as np
 import matplotlib.pyplot as plt
 
 from ptkinetic import Kinetic
+from ptkinetic.plotting import downsample
+
+class Worker(QThread):
+    '''Run the simulation outside of the GUI thread'''
+    progress = pyqtSignal(int, object, object) # cycles done, new times, new rows of data
+    failed = pyqtSignal(str)
+
+    def __init__(self, kinetic, cycle, delta, update_every):
+        super().__init__()
+        self.kinetic = kinetic
+        self.cycle = cycle
+        self.delta = delta
+        self.update_every = update_every
+        self.sent = len(kinetic.times) # Rows already given to the GUI
+        self.cancelled = False # Set by cancel, also before the run has started
+
+    def cancel(self):
+        self.cancelled = True
+        self.kinetic.cancel()
+
+    def send(self, done):
+        # Only the rows recorded since the last update are copied
+        times = np.array(self.kinetic.times[self.sent:])
+        data = np.array(self.kinetic.data[self.sent:])
+        self.sent += len(times)
+        self.progress.emit(done, times, data)
+
+    def callback(self, kinetic, done, time, temp):
+        self.send(done)
+        return not self.cancelled
+
+    def run(self):
+        try:
+            self.kinetic.run(self.cycle, self.delta, callback = self.callback, callback_every = self.update_every)
+        except Exception as error: # Any failure is reported to the GUI, not lost in the thread
+            self.failed.emit(str(error))
+        self.send(self.kinetic.stats.get('cycles', 0))
 
 class App(QMainWindow):
     def __init__(self):
@@ -19,6 +58,9 @@ class App(QMainWindow):
         self.reactants = []
         self.products = []
         self.chemical_graph = []
+        self.worker = None
+        self.live_fig = None
+        self.live_lines = []
 
     def initUI(self):
         label = QLabel(self)
@@ -152,6 +194,18 @@ class App(QMainWindow):
         self.button_run.clicked.connect(self.run)
         self.button_run.setEnabled(False)
 
+        self.button_cancel = QPushButton(self)
+        self.button_cancel.setText('Cancel')
+        self.button_cancel.move(260, 360)
+        self.button_cancel.resize(100,30)
+        self.button_cancel.clicked.connect(self.cancel)
+        self.button_cancel.setEnabled(False)
+
+        self.progress_run = QProgressBar(self)
+        self.progress_run.move(260, 410)
+        self.progress_run.resize(100,30)
+        self.progress_run.setValue(0)
+
         label = QLabel(self)
         label.setText('File name')
         label.move(380, 280)
@@ -310,6 +364,10 @@ class App(QMainWindow):
         self.line_cycle.setEnabled(True)
         self.line_time.setEnabled(True)
         self.button_run.setEnabled(True)
+        # The chemicals to plot can be chosen before the first run to follow it live
+        self.list_graph.setEnabled(True)
+        self.button_add.setEnabled(True)
+        self.button_remove.setEnabled(True)
 
     def run(self):
         cycle = None
@@ -334,7 +392,83 @@ class App(QMainWindow):
             QMessageBox.warning(self, 'Value Error', 'The time step is not correct',
                                 QMessageBox.Ok, QMessageBox.Ok)
             return
-        self.kinetic.run(cycle, delta)
+        # The simulation runs in a worker thread, the plot of the chosen chemicals is updated while it runs
+        self.button_run.setEnabled(False)
+        self.button_cancel.setEnabled(True)
+        self.line_cycle.setEnabled(False)
+        self.line_time.setEnabled(False)
+        self.button_file.setEnabled(False)
+        self.button_graph.setEnabled(False)
+        self.progress_run.setMaximum(cycle)
+        self.progress_run.setValue(0)
+        self.start_live_plot()
+        self.worker = Worker(self.kinetic, cycle, delta, max(1, cycle // 100))
+        self.worker.progress.connect(self.update_progress)
+        self.worker.failed.connect(self.run_failed)
+        self.worker.finished.connect(self.run_finished)
+        self.worker.start()
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+        self.button_cancel.setEnabled(False)
+
+    def start_live_plot(self):
+        self.live_lines = []
+        if len(self.chemical_graph) == 0:
+            self.live_fig = None
+            return
+        # The plotted rows are kept in buffers doubled when full, the lines only draw a decimated copy
+        columns = [self.kinetic.index[name] for name in self.chemical_graph]
+        self.live_columns = columns
+        self.live_size = len(self.kinetic.times)
+        self.live_times = np.array(self.kinetic.times, dtype = float)
+        self.live_data = np.array(self.kinetic.data[:,columns], dtype = float)
+        self.live_fig = plt.figure()
+        ax = self.live_fig.add_subplot(1,1,1)
+        self.live_points = max(100, 2 * int(ax.get_window_extent().width))
+        for i, name in enumerate(self.chemical_graph):
+            line, = ax.plot(*downsample(self.live_times, self.live_data[:,i], self.live_points), label = name)
+            self.live_lines.append(line)
+        ax.legend()
+        self.live_fig.show()
+
+    def update_progress(self, done, times, data):
+        self.progress_run.setValue(done)
+        if self.live_fig is None or len(times) == 0:
+            return
+        size = self.live_size + len(times)
+        if size > len(self.live_times):
+            capacity = max(size, 2 * len(self.live_times))
+            live_times = np.empty(capacity)
+            live_times[:self.live_size] = self.live_times[:self.live_size]
+            live_data = np.empty((capacity, len(self.live_columns)))
+            live_data[:self.live_size] = self.live_data[:self.live_size]
+            self.live_times = live_times
+            self.live_data = live_data
+        self.live_times[self.live_size:size] = times
+        self.live_data[self.live_size:size] = data[:,self.live_columns]
+        self.live_size = size
+        for i, line in enumerate(self.live_lines):
+            line.set_data(*downsample(self.live_times[:size], self.live_data[:size,i], self.live_points))
+        ax = self.live_fig.axes[0]
+        ax.relim()
+        ax.autoscale_view()
+        self.live_fig.canvas.draw_idle()
+
+    def run_failed(self, message):
+        QMessageBox.warning(self, 'Value Error', message, QMessageBox.Ok, QMessageBox.Ok)
+
+    def run_finished(self):
+        if self.kinetic.stats.get('cancelled', False):
+            self.statusBar().showMessage('Simulation cancelled at time ' + str(self.kinetic.times[-1]))
+        else:
+            self.statusBar().showMessage('Simulation finished at time ' + str(self.kinetic.times[-1]))
+        self.worker = None
+        self.button_run.setEnabled(True)
+        self.button_cancel.setEnabled(False)
+        self.line_cycle.setEnabled(True)
+        self.line_time.setEnabled(True)
         self.line_file.setEnabled(True)
         self.button_file.setEnabled(True)
         self.list_graph.setEnabled(True)
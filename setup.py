@@ -8,5 +8,6 @@ setup(name = 'ptkinetic',
       licence = 'GNU',
       packages = ['ptkinetic'],
       install_requires = [],
+      entry_points = {'console_scripts': ['ptkinetic = ptkinetic.cli:main']},
       include_package_data = True,
       zip_safe = False)